@@ -0,0 +1,516 @@
+"""Benchmarks for the bus check-in endpoints on synthetic data.
+
+Usage:
+    python benchmark.py analytics --rows 10000000
+    python benchmark.py registrations --sizes 1000 10000 100000
+    python benchmark.py memory --rows 1000000 4000000
+    python benchmark.py responsiveness --rows 4000000 --requests 16
+    python benchmark.py engines --rows 2000000
+    python benchmark.py timeseries --rows 10000000
+    python benchmark.py topk --rows 10000000 --capacity 32 64 128
+    python benchmark.py quantiles --rows 10000000
+"""
+import argparse
+import asyncio
+import inspect
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+
+import httpx
+import numpy as np
+import pandas as pd
+from fastapi.encoders import jsonable_encoder
+
+import main
+
+
+def synthetic_checkins(n_rows, n_routes=400, seed=0):
+    """Build a (Date, Hour, Route) sorted check-in frame shaped like ceck_in_buss.csv."""
+    rng = np.random.default_rng(seed)
+    cells_per_day = 24 * n_routes
+    n_days = -(-n_rows // cells_per_day)
+    cell = np.arange(n_rows)
+    route_names = np.array([str(r) for r in range(1, n_routes + 1)], dtype=object)
+    operators = np.array(["BakuBus", "Sahil", "Metro Trans", "AzTrans", "Qala"], dtype=object)
+
+    smartcard = rng.integers(0, 400, n_rows)
+    qr = rng.integers(0, 80, n_rows)
+    df = pd.DataFrame({
+        'Date': pd.Timestamp("2022-01-01").to_datetime64() + (cell // cells_per_day).astype('timedelta64[D]'),
+        'Hour': (cell // n_routes) % 24,
+        'Route': route_names[cell % n_routes],
+        'Total Count': smartcard + qr,
+        'By SmartCard': smartcard,
+        'By QR': qr,
+        'Number Of Busses': rng.integers(1, 12, n_rows),
+        'Operator': operators[cell % n_routes % len(operators)],
+    })
+    print(f"Generated {n_rows:,} rows over {n_days} days and {n_routes} routes")
+    return df
+
+
+def legacy_bus_analytics(bus_data, start_date=None, end_date=None, hour_start=None, hour_end=None,
+                         companies=None, routes=None):
+    """get_bus_analytics as it was before the cube: a copy plus six groupbys per call."""
+    df = bus_data.copy()
+
+    if start_date:
+        df = df[df['Date'] >= pd.to_datetime(start_date)]
+    if end_date:
+        df = df[df['Date'] <= pd.to_datetime(end_date)]
+    if hour_start is not None:
+        df = df[df['Hour'] >= hour_start]
+    if hour_end is not None:
+        df = df[df['Hour'] <= hour_end]
+    if companies:
+        df = df[df['Operator'].isin(companies.split(','))]
+    if routes:
+        df = df[df['Route'].isin(routes.split(','))]
+
+    total_passengers = int(df['Total Count'].sum())
+    total_buses = int(df['Number Of Busses'].sum())
+    avg_pass_per_bus = total_passengers / total_buses if total_buses > 0 else 0
+
+    hourly = df.groupby('Hour')['Total Count'].sum()
+    peak_hour = int(hourly.idxmax()) if len(hourly) > 0 else 0
+
+    by_company = df.groupby('Operator').agg({'Total Count': 'sum', 'Number Of Busses': 'sum'})
+    by_company['pass_per_bus'] = by_company['Total Count'] / by_company['Number Of Busses']
+    most_efficient = by_company['pass_per_bus'].idxmax() if len(by_company) > 0 else "N/A"
+
+    by_company_payment = df.groupby('Operator').agg({'By SmartCard': 'sum', 'Total Count': 'sum'})
+    by_company_payment['smartcard_pct'] = by_company_payment['By SmartCard'] / by_company_payment['Total Count'] * 100
+    payment_leader = by_company_payment['smartcard_pct'].idxmax() if len(by_company_payment) > 0 else "N/A"
+
+    company_agg = df.groupby('Operator').agg({
+        'Total Count': 'sum', 'Number Of Busses': 'sum', 'By SmartCard': 'sum', 'By QR': 'sum'
+    }).reset_index()
+    company_agg['pass_per_bus'] = company_agg['Total Count'] / company_agg['Number Of Busses']
+
+    route_agg = df.groupby('Route').agg({
+        'Total Count': 'sum', 'Number Of Busses': 'sum', 'By SmartCard': 'sum', 'By QR': 'sum',
+        'Operator': 'first'
+    }).reset_index()
+    route_agg['pass_per_bus'] = route_agg['Total Count'] / route_agg['Number Of Busses']
+
+    hour_agg = df.groupby('Hour').agg({
+        'Total Count': 'sum', 'Number Of Busses': 'sum', 'By SmartCard': 'sum', 'By QR': 'sum'
+    }).reset_index()
+    hour_agg['pass_per_bus'] = hour_agg['Total Count'] / hour_agg['Number Of Busses']
+
+    return {
+        "kpis": {
+            "total_passengers": total_passengers,
+            "total_buses": total_buses,
+            "avg_pass_per_bus": round(avg_pass_per_bus, 1),
+            "peak_hour": peak_hour,
+            "most_efficient_company": most_efficient,
+            "payment_leader": payment_leader
+        },
+        "by_company": company_agg.to_dict('records'),
+        "by_route": route_agg.to_dict('records'),
+        "by_hour": hour_agg.to_dict('records'),
+    }
+
+
+def fused_bus_analytics(cube, start_date=None, end_date=None, hour_start=None, hour_end=None,
+                        companies=None, routes=None):
+    agg = main.aggregate_analytics(
+        cube, start_date, end_date, hour_start, hour_end,
+        companies.split(',') if companies else None,
+        routes.split(',') if routes else None
+    )
+    return {
+        "kpis": main.analytics_kpis(agg),
+        "by_company": agg['by_company'].to_dict('records'),
+        "by_route": agg['by_route'].to_dict('records'),
+        "by_hour": agg['by_hour'].to_dict('records'),
+    }
+
+
+def best_of(repeat, func, *args, **kwargs):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func(*args, **kwargs)
+        timings.append(time.perf_counter() - started)
+    return min(timings), result
+
+
+def bench_analytics(args):
+    raw = synthetic_checkins(args.rows)
+    last_day = raw['Date'].iloc[-1]
+    scenarios = {
+        "all data": {},
+        "last 7 days": {"start_date": str((last_day - pd.Timedelta(days=6)).date())},
+        "peak hours": {"hour_start": 7, "hour_end": 9},
+        "two companies": {"companies": "BakuBus,Sahil"},
+    }
+
+    started = time.perf_counter()
+    compact = main.sort_bus_data(main.compact_bus_data(raw.copy()))
+    cube = main.BusCube(compact)
+    print(f"Compaction and cube build: {time.perf_counter() - started:.2f}s "
+          f"(cube {cube.values.nbytes / 1024 ** 2:.0f} MB)")
+
+    print(f"{'scenario':<16}{'legacy':>12}{'fused':>12}{'speedup':>10}")
+    for name, filters in scenarios.items():
+        legacy_time, expected = best_of(args.repeat, legacy_bus_analytics, raw, **filters)
+        fused_time, result = best_of(args.repeat, fused_bus_analytics, cube, **filters)
+        if result["kpis"] != expected["kpis"]:
+            raise AssertionError(f"{name}: KPIs differ: {result['kpis']} != {expected['kpis']}")
+        print(f"{name:<16}{legacy_time * 1000:>10.1f}ms{fused_time * 1000:>10.1f}ms"
+              f"{legacy_time / fused_time:>9.0f}x")
+
+
+def legacy_registrations_json(df):
+    """The iterrows loop get_bus_registrations used, plus FastAPI's default encoding."""
+    records = []
+    for _, row in df.iterrows():
+        records.append({
+            "Date": row['Date'].isoformat(),
+            "Hour": int(row['Hour']),
+            "Route": str(row['Route']),
+            "Total Count": int(row['Total Count']),
+            "By SmartCard": int(row['By SmartCard']),
+            "By QR": int(row['By QR']),
+            "Number Of Busses": int(row['Number Of Busses']),
+            "Operator": row['Operator']
+        })
+    return json.dumps(jsonable_encoder({"data": records, "total": len(df)})).encode()
+
+
+def vectorized_registrations_json(df):
+    return main.encode_json({"data": main.checkin_records(df), "total": len(df)})
+
+
+def bench_registrations(args):
+    df = main.sort_bus_data(main.compact_bus_data(synthetic_checkins(max(args.sizes))))
+    print(f"JSON encoder: {'orjson' if main.orjson is not None else 'json'}")
+    print(f"{'rows':>8}{'iterrows':>14}{'vectorized':>14}{'speedup':>10}")
+    for size in args.sizes:
+        page = df.iloc[:size]
+        legacy_time, expected = best_of(args.repeat, legacy_registrations_json, page)
+        vectorized_time, result = best_of(args.repeat, vectorized_registrations_json, page)
+        if json.loads(result) != json.loads(expected):
+            raise AssertionError(f"{size} rows: vectorized records differ from iterrows records")
+        print(f"{size:>8}{legacy_time * 1000:>12.1f}ms{vectorized_time * 1000:>12.1f}ms"
+              f"{legacy_time / vectorized_time:>9.0f}x")
+
+
+def legacy_registrations_page(bus_data, route=None, start_date=None, limit=1000):
+    """get_bus_registrations' filtering before the index: a full copy, then masks."""
+    df = bus_data.copy()
+    if route:
+        df = df[df['Route'] == route]
+    if start_date:
+        df = df[df['Date'] >= pd.to_datetime(start_date)]
+    return df.iloc[:limit]
+
+
+def legacy_hourly_trend(bus_data, route=None):
+    df = bus_data.copy()
+    if route:
+        df = df[df['Route'] == route]
+    return df.groupby('Hour')[main.COUNT_COLUMNS].sum().reset_index().to_dict('records')
+
+
+def call_handler(handler, **params):
+    """Run an async endpoint directly, filling unspecified Query(...) parameters with their defaults."""
+    for name, param in inspect.signature(handler).parameters.items():
+        if name not in params:
+            default = param.default
+            params[name] = getattr(default, 'default', None if default is inspect.Parameter.empty else default)
+    return asyncio.run(handler(**params))
+
+
+def peak_allocation(func, *args, **kwargs):
+    tracemalloc.start()
+    try:
+        func(*args, **kwargs)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def bench_memory(args):
+    main.result_cache = main.ResultCache(0)
+    print(f"{'rows':>10}  {'request':<32}{'copying':>12}{'snapshot':>12}")
+    for n_rows in args.rows:
+        df = main.sort_bus_data(main.compact_bus_data(synthetic_checkins(n_rows)))
+        main.bus_snapshot = main.BusSnapshot(df, n_rows)
+        week = str((df['Date'].iloc[-1] - pd.Timedelta(days=6)).date())
+        requests_ = {
+            "registrations, last week": (
+                lambda: legacy_registrations_page(df, start_date=week),
+                lambda: call_handler(main.get_bus_registrations, start_date=week, format="json")
+            ),
+            "registrations, one route": (
+                lambda: legacy_registrations_page(df, route="7"),
+                lambda: call_handler(main.get_bus_registrations, route="7", format="json")
+            ),
+            "analytics, last week": (
+                lambda: legacy_bus_analytics(df, start_date=week),
+                lambda: call_handler(main.get_bus_analytics, start_date=week, format="json")
+            ),
+            "hourly trend, one route": (
+                lambda: legacy_hourly_trend(df, route="7"),
+                lambda: call_handler(main.get_hourly_trend, route="7")
+            ),
+        }
+        for name, (legacy, current) in requests_.items():
+            legacy_peak = peak_allocation(legacy)
+            current_peak = peak_allocation(current)
+            print(f"{n_rows:>10}  {name:<32}{legacy_peak / 1024 ** 2:>10.1f}MB{current_peak / 1024 ** 2:>10.1f}MB")
+
+
+class InlinePool:
+    """Runs handler work directly on the event loop, as every endpoint did before the query pool."""
+
+    queued = 0
+
+    async def run(self, func, *args):
+        return func(*args)
+
+
+async def probe_health_during(requests_):
+    """Fire the heavy requests concurrently and probe /health every 5ms until they finish."""
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        heavy = asyncio.gather(*(client.get(path, params=params) for path, params in requests_))
+        heavy = asyncio.ensure_future(heavy)
+        latencies = []
+        while not heavy.done():
+            # Time from when the probe is due, so time the loop spends blocked counts.
+            due = time.perf_counter() + 0.005
+            await asyncio.sleep(0.005)
+            await client.get("/health")
+            latencies.append(time.perf_counter() - due)
+        for response in await heavy:
+            response.raise_for_status()
+    return np.array(latencies) * 1000
+
+
+def bench_responsiveness(args):
+    main.result_cache = main.ResultCache(0)
+    df = main.sort_bus_data(main.compact_bus_data(synthetic_checkins(args.rows)))
+    main.bus_snapshot = main.BusSnapshot(df, 1)
+    last_day = df['Date'].iloc[-1]
+    requests_ = []
+    for i in range(args.requests):
+        start = str((last_day - pd.Timedelta(days=30 + i)).date())
+        requests_.append(("/api/bus/analytics", {"start_date": start, "routes": ",".join(map(str, range(1, 50 + i)))}))
+        requests_.append(("/api/bus/registrations", {"sort": "pass_per_bus", "search": str(i), "limit": 5000}))
+
+    pooled = main.query_pool
+    print(f"{len(requests_)} concurrent analytics/registrations requests, {pooled.workers} query workers")
+    print(f"{'execution':<12}{'probes':>8}{'health p50':>14}{'health max':>14}")
+    for name, pool in (("inline", InlinePool()), ("query pool", pooled)):
+        main.query_pool = pool
+        latencies = asyncio.run(probe_health_during(requests_))
+        print(f"{name:<12}{len(latencies):>8}{np.median(latencies):>12.1f}ms{latencies.max():>12.1f}ms")
+    main.query_pool = pooled
+    print(f"query pool wait: {pooled.stats()['wait_ms']}")
+
+
+def engine_results(engine, snapshot, scenarios):
+    """Run every analytics scenario and volume grouping on one engine, timing each."""
+    results, timings = {}, {}
+    for name, filters in scenarios.items():
+        started = time.perf_counter()
+        agg = engine.analytics(snapshot, **filters)
+        timings[name] = time.perf_counter() - started
+        results[name] = {
+            "kpis": main.analytics_kpis(agg),
+            **{key: agg[key].to_dict('records') for key in ("by_route", "by_company", "by_hour")},
+            "dates": agg["dates"]
+        }
+    for group_col in ('Route', 'Hour', 'Operator'):
+        name = f"volume by {group_col.lower()}"
+        started = time.perf_counter()
+        results[name] = engine.volume(snapshot, group_col).to_dict('records')
+        timings[name] = time.perf_counter() - started
+    return results, timings
+
+
+def bench_engines(args):
+    """Conformance and timing of the query engines on one dataset.
+
+    The last tenth of the rows is dropped into the ingest directory, so the
+    engines are also compared on a snapshot with appended files.
+    """
+    if main.duckdb is None:
+        raise SystemExit("duckdb is not installed")
+    df = synthetic_checkins(args.rows)
+    split = len(df) * 9 // 10
+    with tempfile.TemporaryDirectory() as workdir:
+        cwd = os.getcwd()
+        os.chdir(workdir)
+        try:
+            df.iloc[:split].to_csv(main.CHECKIN_CSV, index=False)
+            os.makedirs(main.CHECKIN_DROP_DIR)
+            df.iloc[split:].to_csv(os.path.join(main.CHECKIN_DROP_DIR, "latest.csv"), index=False)
+            main.load_bus_data()
+            snapshot = main.current_snapshot()
+
+            routes = list(snapshot.cube.routes[::25])
+            last_day = df['Date'].iloc[-1]
+            week = str((last_day - pd.Timedelta(days=6)).date())
+            scenarios = {
+                "all data": {},
+                "last 7 days": {"start_date": week},
+                "peak hours": {"hour_start": 7, "hour_end": 9},
+                "two companies": {"companies": ["BakuBus", "Sahil"]},
+                "some routes": {"routes": routes},
+                "everything": {"start_date": "2022-02-01", "end_date": week, "hour_start": 6, "hour_end": 20,
+                               "companies": ["Qala", "AzTrans"], "routes": routes},
+                "empty window": {"start_date": str((last_day + pd.Timedelta(days=1)).date())},
+                "inverted hours": {"hour_start": 12, "hour_end": 8},
+            }
+            expected, pandas_times = engine_results(main.PandasEngine(), snapshot, scenarios)
+            result, duckdb_times = engine_results(main.DuckDBEngine(), snapshot, scenarios)
+        finally:
+            os.chdir(cwd)
+
+    print(f"{'query':<20}{'pandas':>12}{'duckdb':>12}")
+    for name in expected:
+        if main.encode_json(result[name]) != main.encode_json(expected[name]):
+            raise AssertionError(f"{name}: duckdb results differ from pandas")
+        print(f"{name:<20}{pandas_times[name] * 1000:>10.1f}ms{duckdb_times[name] * 1000:>10.1f}ms")
+    print(f"All {len(expected)} queries identical")
+
+
+def resampled_series(bus_data, interval, split=None):
+    """The time series resampled from raw rows, as a per-request groupby would."""
+    freq = {"day": "D", "week": "W-SUN", "month": "M"}[interval]
+    keys = [bus_data['Date'].dt.to_period(freq).dt.start_time.dt.strftime('%Y-%m-%d').rename('Period')]
+    if split:
+        keys.append(bus_data[split.capitalize()].astype(object))
+    columns = ['Total Count', 'Number Of Busses', 'By SmartCard', 'By QR']
+    return bus_data.groupby(keys, observed=True)[columns].sum().reset_index()
+
+
+def bench_timeseries(args):
+    """Time series from the per-snapshot daily rollup vs resampling the raw rows."""
+    snapshot = main.BusSnapshot(main.sort_bus_data(main.compact_bus_data(synthetic_checkins(args.rows))), 1)
+
+    print(f"{'series':<24}{'resample':>12}{'rollup':>12}{'rows':>10}")
+    for interval in main.SERIES_INTERVALS:
+        for split in (None, "route", "operator"):
+            resample_s, expected = best_of(args.repeat, resampled_series, snapshot.data, interval, split)
+            rollup_s, result = best_of(args.repeat, snapshot.daily.series, interval, split)
+            key_columns = list(expected.columns[:2 if split else 1])
+            expected = expected.sort_values(key_columns, ignore_index=True)
+            result = result.astype({'Route': object} if split == "route" else {}).sort_values(
+                key_columns, ignore_index=True)
+            if not result[expected.columns].equals(expected.astype(result[expected.columns].dtypes)):
+                raise AssertionError(f"{interval} by {split}: rollup differs from resampled rows")
+            name = f"{interval} by {split or 'total'}"
+            print(f"{name:<24}{resample_s * 1000:>10.1f}ms{rollup_s * 1000:>10.1f}ms{len(result):>10,}")
+
+
+def bench_topk(args):
+    """Exact top routes from the cube vs the merged top route summaries, over growing date windows."""
+    snapshot = main.BusSnapshot(main.sort_bus_data(main.compact_bus_data(synthetic_checkins(args.rows))), 1)
+    dates = snapshot.cube.dates
+    k = 15
+
+    print(f"{'window':<12}{'capacity':>10}{'exact':>12}{'summary':>12}{'recall':>8}{'max err':>10}{'guaranteed':>12}")
+    for days in (7, 30, 90, len(dates)):
+        start = str(pd.Timestamp(dates[-min(days, len(dates))]).date())
+        exact_s, exact = best_of(
+            args.repeat, lambda: main.aggregate_analytics(snapshot.cube, start)['by_route'].nlargest(k, 'Total Count')
+        )
+        for capacity in args.capacity:
+            summaries = main.TopRouteSummaries(snapshot.daily, capacity)
+            summary_s, top = best_of(args.repeat, summaries.top_routes, k, start)
+            recall = len(set(top['Route']) & set(exact['Route'])) / k
+            print(f"{days:>4} days   {capacity:>10}{exact_s * 1000:>10.1f}ms{summary_s * 1000:>10.1f}ms"
+                  f"{recall:>8.0%}{top['error'].max():>10,}{int(top['guaranteed'].sum()):>12}")
+
+
+def exact_load_quantiles(bus_data, group_col, quantiles, start_date=None):
+    """Per-group passengers-per-bus quantiles computed from the raw rows of each request."""
+    df = bus_data.iloc[slice(*main.date_bounds(bus_data, start_date))]
+    df = df[df['Number Of Busses'] > 0]
+    load = df['Total Count'] / df['Number Of Busses']
+    return load.groupby(df[group_col], observed=True).quantile(list(quantiles), interpolation='lower').unstack()
+
+
+def bench_quantiles(args):
+    """Load quantiles from the per-month sketches vs exact quantiles over raw rows."""
+    df = main.sort_bus_data(main.compact_bus_data(synthetic_checkins(args.rows)))
+    started = time.perf_counter()
+    main.LoadSketches(df)
+    print(f"Built load sketches in {(time.perf_counter() - started) * 1000:.0f}ms")
+    snapshot = main.BusSnapshot(df, 1)
+    quantiles = (0.5, 0.9, 0.99)
+    dates = snapshot.cube.dates
+    week = str(pd.Timestamp(dates[-7]).date())
+
+    print(f"{'query':<22}{'exact':>12}{'sketch':>12}{'max rel err':>14}")
+    for name, group_by, start in (("by route, all", "route", None), ("by hour, all", "hour", None),
+                                  ("by route, last week", "route", week)):
+        group_col = group_by.capitalize()
+        exact_s, exact = best_of(args.repeat, exact_load_quantiles, df, group_col, quantiles, start)
+        sketch_s, result = best_of(args.repeat, main.load_distribution, snapshot, group_by, quantiles, start)
+        result = result.set_index(group_col)
+        errors = [
+            ((result[f"p{q * 100:g}"] - exact[q].reindex(result.index)).abs() / exact[q].reindex(result.index)).max()
+            for q in quantiles
+        ]
+        print(f"{name:<22}{exact_s * 1000:>10.1f}ms{sketch_s * 1000:>10.1f}ms{max(errors):>14.4f}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    analytics = commands.add_parser("analytics", help="legacy groupbys vs the fused cube aggregation")
+    analytics.add_argument("--rows", type=int, default=10_000_000)
+    analytics.add_argument("--repeat", type=int, default=3)
+    analytics.set_defaults(func=bench_analytics)
+
+    registrations = commands.add_parser("registrations", help="iterrows vs vectorized record serialization")
+    registrations.add_argument("--sizes", type=int, nargs="+", default=[1_000, 10_000, 100_000])
+    registrations.add_argument("--repeat", type=int, default=3)
+    registrations.set_defaults(func=bench_registrations)
+
+    memory = commands.add_parser("memory", help="tracemalloc peak per request, copying vs snapshot views")
+    memory.add_argument("--rows", type=int, nargs="+", default=[1_000_000, 4_000_000])
+    memory.set_defaults(func=bench_memory)
+
+    responsiveness = commands.add_parser("responsiveness", help="/health latency under concurrent heavy queries")
+    responsiveness.add_argument("--rows", type=int, default=4_000_000)
+    responsiveness.add_argument("--requests", type=int, default=16)
+    responsiveness.set_defaults(func=bench_responsiveness)
+
+    engines = commands.add_parser("engines", help="pandas vs duckdb query engine conformance and timing")
+    engines.add_argument("--rows", type=int, default=2_000_000)
+    engines.set_defaults(func=bench_engines)
+
+    timeseries = commands.add_parser("timeseries", help="daily rollup vs raw-row resampling for time series")
+    timeseries.add_argument("--rows", type=int, default=10_000_000)
+    timeseries.add_argument("--repeat", type=int, default=3)
+    timeseries.set_defaults(func=bench_timeseries)
+
+    topk = commands.add_parser("topk", help="exact vs summarised top-k route rankings over date windows")
+    topk.add_argument("--rows", type=int, default=10_000_000)
+    topk.add_argument("--capacity", type=int, nargs="+", default=[32, 64, 128])
+    topk.add_argument("--repeat", type=int, default=3)
+    topk.set_defaults(func=bench_topk)
+
+    quantiles = commands.add_parser("quantiles", help="exact vs sketched passengers-per-bus quantiles")
+    quantiles.add_argument("--rows", type=int, default=10_000_000)
+    quantiles.add_argument("--repeat", type=int, default=3)
+    quantiles.set_defaults(func=bench_quantiles)
+
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    args.func(args)
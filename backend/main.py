@@ -1,251 +1,2242 @@
-from fastapi import FastAPI, HTTPException, Query, Path as PathParam
+from fastapi import FastAPI, HTTPException, Query, Request, Path as PathParam
+from fastapi.responses import Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from typing import Optional
 from datetime import datetime
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 import pandas as pd
 import geopandas as gpd
+import asyncio
+import base64
+import ctypes
+import gc
+import glob
+import hashlib
+import itertools
 import json
 import requests
 import math
+import os
+import shutil
+import threading
+import time
+from contextlib import contextmanager
 
-app = FastAPI(title="Transportation Data API", version="1.0.0")
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import duckdb
+except ImportError:
+    duckdb = None
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+# Request handlers filter and slice the shared snapshot frames without copying
+# them. Copy-on-write guarantees that no derived frame can write back into them.
+pd.set_option("mode.copy_on_write", True)
 
-bus_data: Optional[pd.DataFrame] = None
+app = FastAPI(title="Transportation Data API", version="1.0.0")
+
+bus_snapshot = None
 geo_data: Optional[gpd.GeoDataFrame] = None
+geo_data_source = None
+
+CHECKIN_CSV = "ceck_in_buss.csv"
+CHECKIN_PARTITIONS = "checkin_partitions"
+PARTITION_MANIFEST = "manifest.json"
+PARTITION_GENERATIONS_KEPT = 2
+
+def source_signature(path):
+    stat = os.stat(path)
+    return {"mtime_ns": stat.st_mtime_ns, "size": stat.st_size}
+
+def month_partitions(df):
+    """Yield (month, lo, hi) for each month's contiguous rows of a Date-sorted frame."""
+    months = df['Date'].values.astype('datetime64[M]')
+    starts = np.concatenate([[0], np.flatnonzero(months[1:] != months[:-1]) + 1]) if len(df) else []
+    for lo, hi in zip(starts, np.append(starts[1:], len(df))):
+        yield str(months[lo]), int(lo), int(hi)
+
+class PartitionManifest:
+    """The month partitions of the on-disk check-in cache and their statistics.
+
+    manifest.json records the signature of the CSV the partitions were
+    written from, the generation that wrote them and, per partition, its
+    file, row count and min/max Date and Hour, so readers can pick the
+    partitions a date range touches without opening the others.
+    """
+
+    def __init__(self, source, partitions, root=CHECKIN_PARTITIONS, generation=0):
+        self.source = source
+        self.partitions = partitions
+        self.root = root
+        self.generation = generation
+
+    @classmethod
+    def load(cls, root=CHECKIN_PARTITIONS):
+        """Return the manifest under root, or None if no cache has been written."""
+        try:
+            with open(os.path.join(root, PARTITION_MANIFEST)) as f:
+                manifest = json.load(f)
+        except FileNotFoundError:
+            return None
+        return cls(manifest["source"], manifest["partitions"], root, manifest.get("generation", 0))
+
+    def overlapping(self, start_date=None, end_date=None):
+        """Partitions whose [min_date, max_date] intersects [start_date, end_date]."""
+        start = pd.to_datetime(start_date) if start_date else None
+        end = pd.to_datetime(end_date) if end_date else None
+        return [
+            partition for partition in self.partitions
+            if (start is None or pd.Timestamp(partition["max_date"]) >= start)
+            and (end is None or pd.Timestamp(partition["min_date"]) <= end)
+        ]
+
+    def files(self, partitions=None):
+        partitions = self.partitions if partitions is None else partitions
+        return [os.path.join(self.root, partition["file"]) for partition in partitions]
+
+def read_checkin_cache(csv_path=CHECKIN_CSV, root=CHECKIN_PARTITIONS):
+    """Return the cached frame, or None if it is missing or stale for csv_path."""
+    if pq is None:
+        return None
+    try:
+        manifest = PartitionManifest.load(root)
+        if manifest is None or not manifest.partitions or manifest.source != source_signature(csv_path):
+            return None
+        # Parquet only keeps string categoricals as dictionaries; numeric route
+        # labels come back as plain integers, so compact them again.
+        return compact_bus_data(pq.read_table(manifest.files()).to_pandas())
+    except Exception as e:
+        print(f"Ignoring unreadable bus data cache: {e}")
+        return None
+
+def write_checkin_cache(df, csv_path=CHECKIN_CSV, root=CHECKIN_PARTITIONS):
+    """Write a Date-sorted frame as one Parquet file per month plus the manifest.
+
+    Each write is a new generation directory of partition files, and the
+    manifest is replaced last, so a reader sees either the old or the new
+    set of partitions.
+    """
+    if pq is None:
+        return False
+    tmp_dir = None
+    try:
+        os.makedirs(root, exist_ok=True)
+        previous = PartitionManifest.load(root)
+        number = (previous.generation if previous else 0) + 1
+        generation = f"g{number:06d}-{os.urandom(4).hex()}"
+        tmp_dir = os.path.join(root, f"{generation}.tmp")
+        os.makedirs(tmp_dir)
+        partitions = []
+        for month, lo, hi in month_partitions(df):
+            part = df.iloc[lo:hi]
+            pq.write_table(pa.Table.from_pandas(part, preserve_index=False), os.path.join(tmp_dir, f"{month}.parquet"))
+            partitions.append({
+                "key": month,
+                "file": f"{generation}/{month}.parquet",
+                "rows": hi - lo,
+                "min_date": part['Date'].iloc[0].isoformat(),
+                "max_date": part['Date'].iloc[-1].isoformat(),
+                "min_hour": int(part['Hour'].min()),
+                "max_hour": int(part['Hour'].max())
+            })
+        os.replace(tmp_dir, os.path.join(root, generation))
+        tmp_dir = None
+        tmp_path = os.path.join(root, f"{PARTITION_MANIFEST}.{os.getpid()}.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump({
+                "source": source_signature(csv_path),
+                "generation": number,
+                "partitions": partitions
+            }, f)
+        os.replace(tmp_path, os.path.join(root, PARTITION_MANIFEST))
+        prune_checkin_cache(root)
+        return True
+    except Exception as e:
+        print(f"Could not write bus data cache: {e}")
+        if tmp_dir is not None:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+        return False
+
+def prune_checkin_cache(root=CHECKIN_PARTITIONS):
+    """Delete all but the newest partition generations.
+
+    The replaced ones stay on disk for a while, so a DuckDB query planned
+    against the previous manifest can still open its files.
+    """
+    names = os.listdir(root)
+    generations = sorted(name for name in names
+                         if name.startswith("g") and not name.endswith(".tmp")
+                         and os.path.isdir(os.path.join(root, name)))
+    # Partition files of the older, flat layout sit directly under root.
+    stale = [name for name in names if name.endswith(".parquet")] + generations[:-PARTITION_GENERATIONS_KEPT]
+    for name in stale:
+        path = os.path.join(root, name)
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+        else:
+            os.remove(path)
+
+COUNT_COLUMNS = ['Total Count', 'By SmartCard', 'By QR', 'Number Of Busses']
+CATEGORY_COLUMNS = ['Route', 'Operator']
+
+KEY_COLUMNS = ['Date', 'Hour', 'Route', 'Operator']
+
+def compact_bus_data(df):
+    """Shrink check-in columns to categoricals and the narrowest safe integer types.
+
+    Rows missing any of KEY_COLUMNS are dropped and blank counters count as
+    0, so every structure built from the frame sees the same rows and the
+    counters are always integers.
+    """
+    incomplete = df[KEY_COLUMNS].isna().any(axis=1)
+    if incomplete.any():
+        print(f"Warning: dropped {int(incomplete.sum())} check-in rows missing one of {KEY_COLUMNS}")
+        df = df[~incomplete.values].reset_index(drop=True)
+    for col in COUNT_COLUMNS:
+        if df[col].isna().any():
+            df[col] = df[col].fillna(0)
+    for col in CATEGORY_COLUMNS:
+        df[col] = df[col].astype('category')
+        # Caches written before labels were read as text can hold numeric ones.
+        if df[col].cat.categories.inferred_type not in ('string', 'empty'):
+            df[col] = df[col].astype(str).astype('category')
+    if df['Hour'].between(0, 255).all():
+        df['Hour'] = df['Hour'].astype('uint8')
+    for col in COUNT_COLUMNS:
+        downcast = 'unsigned' if (df[col] >= 0).all() else 'integer'
+        df[col] = pd.to_numeric(df[col], downcast=downcast)
+    return df
+
+SORT_KEY = ['Date', 'Hour', 'Route']
+
+def is_sorted_by_key(df):
+    dates = df['Date'].values
+    hours = df['Hour'].values
+    route_codes = df['Route'].cat.codes.values
+    after = dates[1:] > dates[:-1]
+    same = dates[1:] == dates[:-1]
+    after |= same & (hours[1:] > hours[:-1])
+    same &= hours[1:] == hours[:-1]
+    return bool(np.all(after | (same & (route_codes[1:] >= route_codes[:-1]))))
+
+def sort_bus_data(df):
+    """Order rows by (Date, Hour, Route) so date and hour ranges are contiguous slices."""
+    if is_sorted_by_key(df):
+        return df
+    return df.sort_values(SORT_KEY, kind='mergesort', ignore_index=True)
+
+def date_bounds(df, start_date=None, end_date=None):
+    """Return the [lo, hi) row positions of a date range in a Date-sorted frame."""
+    return date_slice(df['Date'].values, start_date, end_date)
+
+class RowIndex:
+    """Positions of check-in rows per Route and per Operator, in sorted-frame order.
+
+    Each column's positions are grouped by category code, so the rows of one
+    route or operator are a contiguous, ascending run of the positions array.
+    """
+
+    def __init__(self, df):
+        self._groups = {}
+        for col in CATEGORY_COLUMNS:
+            codes = df[col].cat.codes.values
+            order = np.argsort(codes, kind='stable')
+            bounds = np.searchsorted(codes[order], np.arange(len(df[col].cat.categories) + 1))
+            self._groups[col] = (df[col].cat.categories, order, bounds)
+
+    @classmethod
+    def from_arrays(cls, df, arrays):
+        """Rebuild an index of df from the (order, bounds) pairs returned by arrays()."""
+        index = cls.__new__(cls)
+        index._groups = {
+            col: (df[col].cat.categories, arrays[2 * i], arrays[2 * i + 1])
+            for i, col in enumerate(CATEGORY_COLUMNS)
+        }
+        return index
+
+    def arrays(self):
+        return [array for _, order, bounds in self._groups.values() for array in (order, bounds)]
+
+    def positions(self, col, value, lo=0, hi=None):
+        """Ascending positions of rows where col == value, restricted to [lo, hi)."""
+        categories, order, bounds = self._groups[col]
+        if value not in categories:
+            return order[:0]
+        code = categories.get_loc(value)
+        rows = order[bounds[code]:bounds[code + 1]]
+        return rows[rows.searchsorted(lo):len(rows) if hi is None else rows.searchsorted(hi)]
+
+def select_positions(df, index, route=None, operator=None, start_date=None, end_date=None):
+    """Return the sorted positions of rows matching the filters.
+
+    Without route/operator filters the match is a contiguous date range and is
+    returned as a range, so counting and paging it never materializes rows.
+    """
+    lo, hi = date_bounds(df, start_date, end_date)
+    if not route and not operator:
+        return range(lo, hi)
+    if route and operator:
+        return np.intersect1d(
+            index.positions('Route', route, lo, hi),
+            index.positions('Operator', operator, lo, hi),
+            assume_unique=True
+        )
+    if route:
+        return index.positions('Route', route, lo, hi)
+    return index.positions('Operator', operator, lo, hi)
+
+def filter_positions(df, positions, hour_start=None, hour_end=None, search=None):
+    """Narrow selected positions by hour range and a case-insensitive Route/Operator substring.
+
+    The search term is matched once against each column's categories and rows
+    are then tested by category code, so no per-row string work is done.
+    """
+    if hour_start is None and hour_end is None and not search:
+        return positions
+    rows = slice(positions.start, positions.stop) if isinstance(positions, range) else positions
+    mask = np.ones(len(positions), dtype=bool)
+    if hour_start is not None:
+        mask &= df['Hour'].values[rows] >= hour_start
+    if hour_end is not None:
+        mask &= df['Hour'].values[rows] <= hour_end
+    if search:
+        matched = np.zeros(len(positions), dtype=bool)
+        for col in CATEGORY_COLUMNS:
+            categories = df[col].cat.categories.astype(str)
+            category_match = np.append(categories.str.contains(search, case=False, regex=False), False)
+            matched |= category_match[df[col].cat.codes.values[rows]]
+        mask &= matched
+    return np.asarray(positions)[mask]
+
+SORTABLE_COLUMNS = ['Date', 'Hour', 'Route', 'Total Count', 'By SmartCard', 'By QR',
+                    'Number Of Busses', 'Operator', 'pass_per_bus']
+
+def sort_key_values(df, key, rows=slice(None)):
+    if key == 'pass_per_bus':
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return df['Total Count'].values[rows] / df['Number Of Busses'].values[rows]
+    if isinstance(df[key].dtype, pd.CategoricalDtype):
+        return df[key].cat.codes.values[rows]
+    return df[key].values[rows]
+
+class SortOrders:
+    """Stable ascending row orders of a check-in frame per sortable column, built on first use."""
+
+    def __init__(self, df):
+        self._df = df
+        self._orders = {}
+
+    def order(self, key):
+        if key not in self._orders:
+            order = np.argsort(sort_key_values(self._df, key), kind='stable')
+            order = order.astype(np.int32) if len(order) < 2 ** 31 else order
+            freeze_arrays(order)
+            self._orders[key] = order
+        return self._orders[key]
+
+def sort_positions(df, orders, positions, key, descending=False):
+    """Order selected positions by a column, ties kept in (Date, Hour, Route) order.
+
+    Small selections are argsorted directly; large ones are read off the
+    prebuilt whole-frame order with a membership mask, which is O(n) with no
+    per-request sort. Descending is the exact reverse of ascending.
+    """
+    if key == 'Date':
+        ordered = positions
+    elif len(positions) * 8 < len(df):
+        rows = np.asarray(positions)
+        ordered = rows[np.argsort(sort_key_values(df, key, rows), kind='stable')]
+    else:
+        member = np.zeros(len(df), dtype=bool)
+        member[positions] = True
+        order = orders.order(key)
+        ordered = order[member[order]]
+    return ordered[::-1] if descending else ordered
+
+def key_position(df, date, hour, route):
+    """Binary-search the first position whose (Date, Hour, Route) key is >= the given key."""
+    lo, hi = date_bounds(df, date, date)
+    hours = df['Hour'].values[lo:hi]
+    lo, hi = lo + int(hours.searchsorted(hour, side='left')), lo + int(hours.searchsorted(hour, side='right'))
+    route_codes = df['Route'].cat.codes.values[lo:hi]
+    code = int(df['Route'].cat.categories.searchsorted(route))
+    return lo + int(route_codes.searchsorted(code, side='left'))
+
+def encode_cursor(df, position):
+    """Opaque cursor pointing just past the row at position, keyed by (Date, Hour, Route)."""
+    position = int(position)
+    row = df.iloc[position]
+    date, hour, route = row['Date'].isoformat(), int(row['Hour']), row['Route']
+    key = [date, hour, route.item() if hasattr(route, 'item') else route]
+    key.append(position - key_position(df, date, hour, route))
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode().rstrip('=')
+
+def decode_cursor(df, cursor):
+    """Return the first position after the row a cursor points at."""
+    try:
+        date, hour, route, duplicate = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        return key_position(df, date, int(hour), route) + int(duplicate) + 1
+    except (ValueError, TypeError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid cursor: {e}")
+
+CUBE_ROWS = len(COUNT_COLUMNS)
+
+def date_slice(dates, start_date=None, end_date=None):
+    """Return the [lo, hi) positions of an inclusive date range in a sorted datetime64 array."""
+    lo, hi = 0, len(dates)
+    if start_date:
+        lo = int(dates.searchsorted(pd.to_datetime(start_date).to_datetime64(), side='left'))
+    if end_date:
+        hi = int(dates.searchsorted(pd.to_datetime(end_date).to_datetime64(), side='right'))
+    return lo, max(lo, hi)
+
+def narrow_cube_values(values):
+    """Store cube sums in 32 bits when they fit, signed if any counter sum is negative."""
+    dtype = np.uint32 if values.min(initial=0) >= 0 else np.int32
+    if values.min(initial=0) < np.iinfo(dtype).min or values.max(initial=0) > np.iinfo(dtype).max:
+        dtype = np.int64
+    return values.astype(dtype)
+
+def report_shared_routes(routes):
+    """Log routes whose rows name more than one operator; the cube keeps only their first."""
+    if len(routes):
+        print(f"Warning: routes with more than one operator: {sorted(map(str, routes))}; "
+              "analytics attribute all their rows to the first operator seen")
+
+class BusCube:
+    """Dense Date x Hour x Route sums of the check-in counters.
+
+    values has shape (measure, date, hour, route), with one plane per entry of
+    COUNT_COLUMNS plus a final plane counting the raw rows behind each cell, so
+    empty groups can be told apart from groups that sum to zero. Operator is
+    kept as an attribute of the route axis, so each route is attributed to
+    the operator of its first row; routes seen with several operators are
+    reported when the cube is built or merged.
+    """
+
+    def __init__(self, df):
+        self.dates = np.unique(df['Date'].values)
+        self.routes = pd.Index(df['Route'].cat.categories)
+        self.route_operators = (
+            df.groupby('Route', observed=False)['Operator'].first().reindex(self.routes).astype(object)
+        )
+        operator_counts = df.groupby('Route', observed=True)['Operator'].nunique()
+        report_shared_routes(operator_counts.index[operator_counts.values > 1])
+        self.n_hours = max(24, int(df['Hour'].max()) + 1) if len(df) else 24
+
+        shape = (len(self.dates), self.n_hours, len(self.routes))
+        size = int(np.prod(shape))
+        date_idx = self.dates.searchsorted(df['Date'].values).astype(np.int64)
+        cell = (date_idx * self.n_hours + df['Hour'].values) * len(self.routes) + df['Route'].cat.codes.values
+        planes = [np.bincount(cell, weights=df[col].values, minlength=size) for col in COUNT_COLUMNS]
+        planes.append(np.bincount(cell, minlength=size))
+        self.values = narrow_cube_values(np.stack(planes).reshape((len(planes),) + shape))
+
+    def shared_state(self):
+        """Split the cube into arrays and JSON-able axis labels for a shared segment."""
+        arrays = {"values": self.values, "dates": self.dates}
+        labels = {
+            "routes": self.routes.tolist(),
+            "route_operators": self.route_operators.tolist(),
+            "n_hours": self.n_hours
+        }
+        return arrays, labels
+
+    @classmethod
+    def from_shared_state(cls, arrays, labels):
+        cube = cls.__new__(cls)
+        cube.values = arrays["values"]
+        cube.dates = arrays["dates"]
+        cube.routes = pd.Index(labels["routes"])
+        cube.route_operators = pd.Series(labels["route_operators"], index=cube.routes, dtype=object)
+        cube.n_hours = labels["n_hours"]
+        return cube
+
+    def merged(self, other):
+        """Return a cube holding the sums of both cubes, over the union of their axes.
+
+        This costs O(cube cells) and never touches raw rows, so appending a
+        day of check-ins does not re-aggregate the history.
+        """
+        merged = BusCube.__new__(BusCube)
+        merged.dates = np.union1d(self.dates, other.dates)
+        merged.routes = self.routes.union(other.routes)
+        merged.route_operators = self.route_operators.combine_first(other.route_operators).reindex(merged.routes)
+        common = self.route_operators.dropna().index.intersection(other.route_operators.dropna().index)
+        report_shared_routes(
+            common[self.route_operators[common].values != other.route_operators[common].values]
+        )
+        merged.n_hours = max(self.n_hours, other.n_hours)
+        values = np.zeros(
+            (len(self.values), len(merged.dates), merged.n_hours, len(merged.routes)), dtype=np.int64
+        )
+        for cube in (self, other):
+            cells = np.ix_(
+                np.arange(len(cube.values)),
+                merged.dates.searchsorted(cube.dates),
+                np.arange(cube.n_hours),
+                merged.routes.get_indexer(cube.routes)
+            )
+            values[cells] += cube.values
+        merged.values = narrow_cube_values(values)
+        return merged
+
+    def window(self, start_date=None, end_date=None, hour_start=None, hour_end=None):
+        """Return the (measure, date, hour, route) view for a date/hour range and its first hour."""
+        d_lo, d_hi = date_slice(self.dates, start_date, end_date)
+        h_lo = 0 if hour_start is None else min(max(hour_start, 0), self.n_hours)
+        h_hi = self.n_hours if hour_end is None else min(max(hour_end + 1, h_lo), self.n_hours)
+        return self.values[:, d_lo:d_hi, h_lo:h_hi, :], self.dates[d_lo:d_hi], h_lo
+
+    def route_mask(self, companies=None, routes=None):
+        mask = np.ones(len(self.routes), dtype=bool)
+        if companies:
+            mask &= self.route_operators.isin(companies).values
+        if routes:
+            mask &= self.routes.isin(routes)
+        return mask
+
+SERIES_INTERVALS = ("day", "week", "month")
+
+def bucket_starts(dates, interval):
+    """Map sorted datetime64 dates to the first day of their day, Monday-based week or month."""
+    days = dates.astype('datetime64[D]')
+    if interval == "week":
+        # 1970-01-01 was a Thursday, so day number + 3 counts from a Monday.
+        return days - ((days.view(np.int64) + 3) % 7).astype('timedelta64[D]')
+    if interval == "month":
+        return days.astype('datetime64[M]').astype('datetime64[D]')
+    return days
+
+class DailyRollup:
+    """Per-day sums of the check-in counters per route, rolled up from a BusCube.
+
+    values has shape (measure, date, route) with the same planes as the cube,
+    row counts included. It is built once per snapshot at O(cube cells), so
+    time series over any range are a few sums over days, never over rows.
+    """
+
+    def __init__(self, cube):
+        self.cube = cube
+        self.dates = cube.dates
+        self.routes = cube.routes
+        self.route_operators = cube.route_operators
+        self.values = cube.values.sum(axis=2, dtype=np.int64)
+
+    def series(self, interval="day", split=None, start_date=None, end_date=None, companies=None, routes=None):
+        """Return one row per (period, route or operator) with data, or per period without split."""
+        lo, hi = date_slice(self.dates, start_date, end_date)
+        selected = self.cube.route_mask(companies, routes)
+        values = self.values[:, lo:hi, selected]
+        starts = bucket_starts(self.dates[lo:hi], interval)
+        bounds = np.flatnonzero(starts[1:] != starts[:-1]) + 1
+        periods = starts[np.concatenate([[0], bounds])] if len(starts) else starts
+        summed = np.add.reduceat(values, np.concatenate([[0], bounds]), axis=1) if len(starts) else values
+
+        if split == "route":
+            key_name, keys = "Route", self.routes[selected]
+        elif split == "operator":
+            codes, keys = pd.factorize(self.route_operators[selected].values, sort=True)
+            key_name, summed = "Operator", summed @ (codes[:, None] == np.arange(len(keys))).astype(np.int64)
+        else:
+            key_name, keys, summed = None, [None], summed.sum(axis=2, keepdims=True)
+
+        flat = summed.reshape(len(summed), -1)
+        present = flat[CUBE_ROWS] > 0
+        labels = pd.DatetimeIndex(periods).strftime('%Y-%m-%d')
+        frame = measure_frame('Period', np.repeat(labels, len(keys))[present], flat[:, present])
+        if key_name:
+            frame.insert(1, key_name, np.tile(np.asarray(keys, dtype=object), len(labels))[present])
+        return frame
+
+TOP_ROUTE_CAPACITY = int(os.environ.get("AYNA_TOP_ROUTE_CAPACITY", "64"))
+
+class TopRouteSummary:
+    """The capacity largest route passenger totals, with a bound on the ones dropped.
+
+    A summary starts as an exact top-k: the true totals of the capacity
+    largest routes, and as floor the largest total it left out. merged()
+    adds two summaries and charges a route missing from one side that
+    side's floor, counted as error, then truncates to capacity again.
+
+    codes are route positions on the cube's route axis, sorted by estimate
+    descending. Each estimate overstates the route's true total by at most
+    its error, and any route not kept has a true total of at most floor.
+    """
+
+    def __init__(self, codes, counts, errors, floor):
+        self.codes = codes
+        self.counts = counts
+        self.errors = errors
+        self.floor = floor
+
+    @classmethod
+    def exact(cls, totals, capacity):
+        """Summarise exact per-route totals by keeping the capacity largest."""
+        order = np.argsort(-totals, kind='stable')
+        order = order[totals[order] > 0]
+        floor = int(totals[order[capacity]]) if len(order) > capacity else 0
+        order = order[:capacity]
+        return cls(order, totals[order].astype(np.int64), np.zeros(len(order), dtype=np.int64), floor)
+
+    def merged(self, other, capacity):
+        codes = np.union1d(self.codes, other.codes)
+        counts = np.zeros(len(codes), dtype=np.int64)
+        errors = np.zeros(len(codes), dtype=np.int64)
+        for summary in (self, other):
+            # A route missing from one summary may still have up to its floor there.
+            kept = np.zeros(len(codes), dtype=bool)
+            at = codes.searchsorted(summary.codes)
+            kept[at] = True
+            counts[at] += summary.counts
+            errors[at] += summary.errors
+            counts[~kept] += summary.floor
+            errors[~kept] += summary.floor
+        order = np.lexsort((codes, -counts))
+        floor = self.floor + other.floor
+        if len(order) > capacity:
+            floor = max(floor, int(counts[order[capacity]]))
+            order = order[:capacity]
+        return TopRouteSummary(codes[order], counts[order], errors[order], floor)
+
+    def top(self, k):
+        """The k highest estimates as (codes, counts, errors, guaranteed).
+
+        A route is guaranteed to be in the true top k when its lower bound is
+        at least the upper bound of every route ranked below it.
+        """
+        codes, counts, errors = self.codes[:k], self.counts[:k], self.errors[:k]
+        outside = max(int(self.counts[k]) if len(self.counts) > k else 0, self.floor)
+        return codes, counts, errors, counts - errors >= outside
+
+class TopRouteSummaries:
+    """One TopRouteSummary of Total Count per month partition of a DailyRollup.
+
+    Ranges answered from it merge the summaries of the months they cover
+    whole, plus exact summaries of the days in any partial month at either
+    end, so only the edges ever look at daily values.
+    """
+
+    def __init__(self, daily, capacity=TOP_ROUTE_CAPACITY):
+        self.daily = daily
+        self.capacity = capacity
+        starts = bucket_starts(daily.dates, "month")
+        self.bounds = np.concatenate([[0], np.flatnonzero(starts[1:] != starts[:-1]) + 1, [len(starts)]]) \
+            if len(starts) else np.zeros(1, dtype=np.int64)
+        passengers = daily.values[COUNT_COLUMNS.index('Total Count')]
+        self.summaries = [
+            TopRouteSummary.exact(passengers[lo:hi].sum(axis=0), capacity)
+            for lo, hi in zip(self.bounds[:-1], self.bounds[1:])
+        ]
+
+    def days_summary(self, lo, hi):
+        passengers = self.daily.values[COUNT_COLUMNS.index('Total Count'), lo:hi]
+        return TopRouteSummary.exact(passengers.sum(axis=0), self.capacity)
+
+    def summary(self, start_date=None, end_date=None):
+        lo, hi = date_slice(self.daily.dates, start_date, end_date)
+        empty = np.zeros(0, dtype=np.int64)
+        merged = TopRouteSummary(empty, empty, empty, 0)
+        for i, summary in enumerate(self.summaries):
+            p_lo, p_hi = self.bounds[i], self.bounds[i + 1]
+            if p_hi <= lo or p_lo >= hi:
+                continue
+            if p_lo < lo or p_hi > hi:
+                summary = self.days_summary(max(p_lo, lo), min(p_hi, hi))
+            merged = merged.merged(summary, self.capacity)
+        return merged
+
+    def top_routes(self, k, start_date=None, end_date=None):
+        """Approximate top k routes by Total Count, with their error bounds."""
+        codes, counts, errors, guaranteed = self.summary(start_date, end_date).top(k)
+        return pd.DataFrame({
+            'Route': self.daily.routes[codes].astype(object),
+            'Operator': self.daily.route_operators.values[codes],
+            'Total Count': counts,
+            'error': errors,
+            'guaranteed': guaranteed
+        })
+
+LOAD_SKETCH_ACCURACY = 0.02
+LOAD_GAMMA = (1 + LOAD_SKETCH_ACCURACY) / (1 - LOAD_SKETCH_ACCURACY)
+LOAD_BIN_OFFSET = math.floor(math.log(1e-2) / math.log(LOAD_GAMMA))
+LOAD_BINS = math.ceil(math.log(1e5) / math.log(LOAD_GAMMA)) - LOAD_BIN_OFFSET + 1
+
+def load_bins(df, rows=slice(None)):
+    """Log-spaced bin of passengers per bus for each row, and which rows have any buses.
+
+    Bin 0 holds zero loads and bin i > 0 holds loads in
+    (LOAD_GAMMA ** (i + LOAD_BIN_OFFSET - 1), LOAD_GAMMA ** (i + LOAD_BIN_OFFSET)];
+    loads outside [1e-2, 1e5] are clamped into the end bins.
+    """
+    buses = df['Number Of Busses'].values[rows]
+    valid = buses > 0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        load = df['Total Count'].values[rows] / buses
+        bins = np.ceil(np.log(load) / math.log(LOAD_GAMMA)) - LOAD_BIN_OFFSET
+    bins = np.where(load > 0, np.clip(np.nan_to_num(bins, nan=0), 1, LOAD_BINS - 1), 0)
+    return valid, bins.astype(np.int64)
+
+def load_quantiles(histograms, quantiles):
+    """Read quantiles off (key, bin) load histograms, each within LOAD_SKETCH_ACCURACY relative error."""
+    cumulative = histograms.cumsum(axis=1)
+    counts = cumulative[:, -1:]
+    result = {}
+    for q in quantiles:
+        rank = np.floor(q * (counts - 1))
+        bins = (cumulative > rank).argmax(axis=1)
+        value = 2 * LOAD_GAMMA ** (bins + LOAD_BIN_OFFSET) / (LOAD_GAMMA + 1)
+        result[q] = np.where(bins == 0, 0.0, value)
+    return result
+
+class LoadSketches:
+    """Mergeable quantile sketches of passengers per bus, per month partition.
+
+    by_route has shape (month, route, bin) and by_hour (month, hour, bin);
+    each is a histogram of check-in rows over the log-spaced bins of
+    load_bins(), so quantiles read back from any sum of them are within
+    LOAD_SKETCH_ACCURACY of the true value, relatively. Sketches of
+    different months, and of appended rows, merge by adding counts.
+    """
+
+    def __init__(self, df):
+        months = df['Date'].values.astype('datetime64[M]')
+        self.months = np.unique(months)
+        self.routes = pd.Index(df['Route'].cat.categories)
+        self.n_hours = max(24, int(df['Hour'].max()) + 1) if len(df) else 24
+
+        valid, bins = load_bins(df)
+        route_codes = df['Route'].cat.codes.values
+        # A row without a route (code -1) would index before the first cell.
+        valid &= route_codes >= 0
+        month_idx = self.months.searchsorted(months[valid]).astype(np.int64)
+        bins = bins[valid]
+        self.by_route = self._histograms(month_idx, route_codes[valid], bins, len(self.routes))
+        self.by_hour = self._histograms(month_idx, df['Hour'].values[valid], bins, self.n_hours)
+
+    def _histograms(self, month_idx, keys, bins, n_keys):
+        shape = (len(self.months), n_keys, LOAD_BINS)
+        cell = (month_idx * n_keys + keys) * LOAD_BINS + bins
+        return narrow_cube_values(np.bincount(cell, minlength=int(np.prod(shape))).reshape(shape))
+
+    def shared_state(self):
+        arrays = {"by-route": self.by_route, "by-hour": self.by_hour, "months": self.months}
+        return arrays, {"routes": self.routes.tolist(), "n_hours": self.n_hours}
+
+    @classmethod
+    def from_shared_state(cls, arrays, labels):
+        sketches = cls.__new__(cls)
+        sketches.by_route = arrays["by-route"]
+        sketches.by_hour = arrays["by-hour"]
+        sketches.months = arrays["months"]
+        sketches.routes = pd.Index(labels["routes"])
+        sketches.n_hours = labels["n_hours"]
+        return sketches
+
+    def merged(self, other):
+        """Return sketches holding both inputs' counts, over the union of their months and keys."""
+        merged = LoadSketches.__new__(LoadSketches)
+        merged.months = np.union1d(self.months, other.months)
+        merged.routes = self.routes.union(other.routes)
+        merged.n_hours = max(self.n_hours, other.n_hours)
+        by_route = np.zeros((len(merged.months), len(merged.routes), LOAD_BINS), dtype=np.int64)
+        by_hour = np.zeros((len(merged.months), merged.n_hours, LOAD_BINS), dtype=np.int64)
+        for sketches in (self, other):
+            months = merged.months.searchsorted(sketches.months)
+            by_route[np.ix_(months, merged.routes.get_indexer(sketches.routes), np.arange(LOAD_BINS))] += \
+                sketches.by_route
+            by_hour[np.ix_(months, np.arange(sketches.n_hours), np.arange(LOAD_BINS))] += sketches.by_hour
+        merged.by_route = narrow_cube_values(by_route)
+        merged.by_hour = narrow_cube_values(by_hour)
+        return merged
+
+    def whole_months(self, start_date=None, end_date=None):
+        """Return the [lo, hi) range of months lying entirely inside an inclusive date range."""
+        lo, hi = 0, len(self.months)
+        if start_date:
+            start = pd.to_datetime(start_date).to_datetime64().astype('datetime64[D]')
+            lo = int(self.months.searchsorted(start.astype('datetime64[M]'), side='left'))
+            lo += int(lo < len(self.months) and self.months[lo].astype('datetime64[D]') < start)
+        if end_date:
+            end = pd.to_datetime(end_date).to_datetime64().astype('datetime64[D]') + np.timedelta64(1, 'D')
+            hi = int(self.months.searchsorted(end.astype('datetime64[M]'), side='right'))
+            hi -= int(hi > 0 and (self.months[hi - 1] + 1).astype('datetime64[D]') > end)
+        return lo, max(lo, hi)
+
+# Partial months at both ends of a range bin at most about this many days of
+# rows, so filters the sketches cannot express are allowed no more than that.
+LOAD_SCAN_MAX_DAYS = 62
+
+def load_distribution(snapshot, group_by, quantiles, start_date=None, end_date=None, hour_start=None,
+                      hour_end=None, companies=None, routes=None):
+    """Passengers-per-bus quantiles per route or per hour.
+
+    Months lying wholly inside the date range are read from the snapshot's
+    load sketches, selecting only the routes or hours the filters allow;
+    rows of partially covered months are binned the same way on the fly.
+    Filters the chosen sketch cannot express (hours when grouping by route,
+    routes when grouping by hour) send the whole range down the row path,
+    so they are refused over ranges of more than LOAD_SCAN_MAX_DAYS days.
+    """
+    sketches = snapshot.load_sketches
+    df = snapshot.data
+    route_selected = snapshot.cube.route_mask(companies, routes)[snapshot.cube.routes.get_indexer(sketches.routes)]
+    hours = np.arange(sketches.n_hours)
+    hour_selected = np.ones(len(hours), dtype=bool)
+    if hour_start is not None:
+        hour_selected &= hours >= hour_start
+    if hour_end is not None:
+        hour_selected &= hours <= hour_end
+    if group_by == 'route':
+        keys, selected, sketch = sketches.routes, route_selected, sketches.by_route
+        expressible = hour_start is None and hour_end is None
+    else:
+        keys, selected, sketch = hours, hour_selected, sketches.by_hour
+        expressible = not companies and not routes
+    if not expressible:
+        r_lo, r_hi = date_bounds(df, start_date, end_date)
+        if r_lo < r_hi and df['Date'].iloc[r_hi - 1] - df['Date'].iloc[r_lo] >= pd.Timedelta(days=LOAD_SCAN_MAX_DAYS):
+            filters = "hour filters" if group_by == 'route' else "company and route filters"
+            raise HTTPException(
+                status_code=400,
+                detail=f"{filters} with group_by={group_by} need a date range of at most {LOAD_SCAN_MAX_DAYS} days"
+            )
+
+    lo, hi = sketches.whole_months(start_date, end_date) if expressible else (0, 0)
+    histograms = sketch[lo:hi].sum(axis=0, dtype=np.int64)
+    if lo == hi:
+        edges = [(start_date, end_date)]
+    else:
+        one_day = np.timedelta64(1, 'D')
+        edges = [(start_date, str(sketches.months[lo].astype('datetime64[D]') - one_day)),
+                 (str((sketches.months[hi - 1] + 1).astype('datetime64[D]')), end_date)]
+    route_keys = sketches.routes.get_indexer(df['Route'].cat.categories)
+    for edge_start, edge_end in edges:
+        r_lo, r_hi = date_bounds(df, edge_start, edge_end)
+        if r_lo == r_hi:
+            continue
+        rows = slice(r_lo, r_hi)
+        valid, bins = load_bins(df, rows)
+        codes = df['Route'].cat.codes.values[rows]
+        route_codes = route_keys[codes]
+        hour_codes = df['Hour'].values[rows].astype(np.int64)
+        valid &= (codes >= 0) & route_selected[route_codes] & hour_selected[hour_codes]
+        row_keys = route_codes if group_by == 'route' else hour_codes
+        cell = row_keys[valid] * LOAD_BINS + bins[valid]
+        histograms = histograms + np.bincount(cell, minlength=histograms.size).reshape(histograms.shape)
+
+    counts = histograms.sum(axis=1)
+    present = selected & (counts > 0)
+    histograms = histograms[present]
+    key_name = 'Route' if group_by == 'route' else 'Hour'
+    frame = pd.DataFrame({key_name: np.asarray(keys[present], dtype=object if group_by == 'route' else np.int64)})
+    if group_by == 'route':
+        frame['Operator'] = snapshot.cube.route_operators.reindex(keys[present]).astype(object).values
+    frame['rows'] = counts[present]
+    for q, values in load_quantiles(histograms, quantiles).items():
+        frame[f"p{q * 100:g}"] = values.round(2)
+    return frame
+
+def measure_frame(key_name, keys, totals):
+    """Build a groupby-shaped frame from rolled-up cube totals (measure, key)."""
+    frame = pd.DataFrame({key_name: keys})
+    for col in ['Total Count', 'Number Of Busses', 'By SmartCard', 'By QR']:
+        frame[col] = totals[COUNT_COLUMNS.index(col)].astype(np.int64)
+    return frame
+
+ANALYTICS_GROUPINGS = ("totals", "by_route", "by_company", "by_hour", "dates")
+
+def aggregate_analytics(cube, start_date=None, end_date=None, hour_start=None, hour_end=None,
+                        companies=None, routes=None, groupings=ANALYTICS_GROUPINGS):
+    """Roll the filtered cube window up once and derive the requested analytics groupings from it.
+
+    The window is collapsed over its date axis in a single pass into a
+    (measure, hour, route) grid; totals, by_route, by_company and by_hour are
+    all small sums of that grid. The only other read of the window is its
+    row-count plane, to list the dates that have data, skipped unless
+    dates is among the groupings.
+    """
+    window, window_dates, first_hour = cube.window(start_date, end_date, hour_start, hour_end)
+    selected = cube.route_mask(companies, routes)
+    grid = window.sum(axis=1, dtype=np.int64)[..., selected]
+    
+    dates = []
+    if "dates" in groupings:
+        date_present = (window[CUBE_ROWS].sum(axis=1, dtype=np.int64)[:, selected] > 0).any(axis=1)
+        dates = pd.DatetimeIndex(window_dates[date_present]).strftime('%Y-%m-%d').unique().tolist()
+    
+    return rollup_analytics(
+        grid, cube.routes[selected], cube.route_operators[selected],
+        np.arange(first_hour, first_hour + grid.shape[1]), dates, groupings
+    )
+
+def rollup_analytics(grid, routes, route_operators, hours, dates, groupings=ANALYTICS_GROUPINGS):
+    """Derive the requested groupings among totals, by_route, by_company and by_hour from a grid.
+
+    grid holds one plane per COUNT_COLUMNS entry plus the row-count plane,
+    shaped (measure, hour, route); routes and route_operators label its
+    route axis and hours its hour axis. by_company is summed from by_route.
+    Every query engine ends here, so they derive the groupings identically.
+    """
+    agg = {}
+    if "totals" in groupings:
+        agg["totals"] = grid.sum(axis=(1, 2))
+    if "by_route" in groupings or "by_company" in groupings:
+        route_totals = grid.sum(axis=1)
+        route_present = route_totals[CUBE_ROWS] > 0
+        route_agg = measure_frame('Route', routes[route_present], route_totals[:, route_present])
+        route_agg['Operator'] = route_operators[route_present].astype(object).values
+        route_agg['pass_per_bus'] = route_agg['Total Count'] / route_agg['Number Of Busses']
+        if "by_route" in groupings:
+            agg["by_route"] = route_agg
+    
+    if "by_company" in groupings:
+        company_agg = route_agg.groupby('Operator')[
+            ['Total Count', 'Number Of Busses', 'By SmartCard', 'By QR']
+        ].sum().reset_index()
+        company_agg['pass_per_bus'] = company_agg['Total Count'] / company_agg['Number Of Busses']
+        agg["by_company"] = company_agg
+    
+    if "by_hour" in groupings:
+        hour_totals = grid.sum(axis=2)
+        hour_present = hour_totals[CUBE_ROWS] > 0
+        hour_agg = measure_frame('Hour', hours[hour_present], hour_totals[:, hour_present])
+        hour_agg['pass_per_bus'] = hour_agg['Total Count'] / hour_agg['Number Of Busses']
+        agg["by_hour"] = hour_agg
+    
+    if "dates" in groupings:
+        agg["dates"] = sorted(dates)
+    return agg
+
+def analytics_kpis(agg):
+    """Derive the headline KPIs from the groupings built by aggregate_analytics."""
+    total_passengers = int(agg['totals'][COUNT_COLUMNS.index('Total Count')])
+    total_buses = int(agg['totals'][COUNT_COLUMNS.index('Number Of Busses')])
+    avg_pass_per_bus = total_passengers / total_buses if total_buses > 0 else 0
+    
+    by_hour = agg['by_hour'].set_index('Hour')
+    peak_hour = int(by_hour['Total Count'].idxmax()) if len(by_hour) > 0 else 0
+    
+    by_company = agg['by_company'].set_index('Operator')
+    most_efficient = by_company['pass_per_bus'].idxmax() if len(by_company) > 0 else "N/A"
+    smartcard_pct = by_company['By SmartCard'] / by_company['Total Count'] * 100
+    payment_leader = smartcard_pct.idxmax() if len(by_company) > 0 else "N/A"
+    
+    return {
+        "total_passengers": total_passengers,
+        "total_buses": total_buses,
+        "avg_pass_per_bus": round(avg_pass_per_bus, 1),
+        "peak_hour": peak_hour,
+        "most_efficient_company": most_efficient,
+        "payment_leader": payment_leader
+    }
+
+QUERY_ENGINE = os.environ.get("AYNA_QUERY_ENGINE", "pandas")
+
+class PandasEngine:
+    """Answers analytics and volume queries from the in-memory snapshot's cube and totals."""
+
+    name = "pandas"
+
+    def analytics(self, snapshot, start_date=None, end_date=None, hour_start=None, hour_end=None,
+                  companies=None, routes=None, groupings=ANALYTICS_GROUPINGS):
+        return aggregate_analytics(
+            snapshot.cube, start_date, end_date, hour_start, hour_end, companies, routes, groupings
+        )
+
+    def volume(self, snapshot, group_col):
+        totals = snapshot.totals
+        grouped = {'Route': totals.by_route, 'Hour': totals.by_hour, 'Operator': totals.by_operator}[group_col]
+        return grouped[COUNT_COLUMNS].rename_axis(group_col).reset_index()
+
+class DuckDBEngine:
+    """Answers analytics and volume queries with DuckDB SQL over the dataset files.
+
+    The base check-ins are scanned from the Parquet cache (or the CSV when the
+    cache is stale) together with the drop-directory files the snapshot has
+    ingested. DuckDB scans them on all cores and spills large aggregations to
+    disk. Analytics reduce to the same (measure, hour, route) grid the cube
+    yields and finish in rollup_analytics, so both engines return identical
+    results.
+
+    This only changes how these two queries run. build_base_snapshot still
+    loads every row into memory for the cube, totals, sketches and the other
+    endpoints, so the dataset must fit in memory whichever engine is chosen.
+    """
+
+    name = "duckdb"
+
+    def __init__(self):
+        self._connection = duckdb.connect()
+        self._lock = threading.Lock()
+        self._route_operators = (None, None)
+
+    def _source(self, snapshot, start_date=None, end_date=None):
+        """SQL and parameters scanning the dataset files that can hold rows in the date range."""
+        columns = ", ".join(
+            ['CAST("Date" AS TIMESTAMP) AS "Date"', 'CAST("Hour" AS BIGINT) AS "Hour"',
+             'CAST("Route" AS VARCHAR) AS "Route"']
+            + [f'COALESCE(CAST("{col}" AS BIGINT), 0) AS "{col}"' for col in COUNT_COLUMNS]
+            + ['CAST("Operator" AS VARCHAR) AS "Operator"']
+        )
+        # The rows compact_bus_data keeps: complete keys, blank counters as 0.
+        complete = " AND ".join(f'"{col}" IS NOT NULL' for col in KEY_COLUMNS)
+        manifest = PartitionManifest.load()
+        if snapshot.source is not None and manifest is not None and manifest.partitions \
+                and manifest.source == snapshot.source:
+            # Queries filter on the date range anyway, so when no partition
+            # overlaps it, scanning any one of them yields the empty result.
+            partitions = manifest.overlapping(start_date, end_date) or manifest.partitions[:1]
+            scans, params = [f"SELECT {columns} FROM read_parquet(?) WHERE {complete}"], [manifest.files(partitions)]
+        else:
+            scans, params = [f"SELECT {columns} FROM read_csv(?, header = true) WHERE {complete}"], [CHECKIN_CSV]
+        drop_files = [
+            os.path.join(CHECKIN_DROP_DIR, info["file"]) for info in snapshot.ingested.values()
+            if not (start_date and "max_date" in info and pd.Timestamp(info["max_date"]) < pd.to_datetime(start_date))
+            and not (end_date and "min_date" in info and pd.Timestamp(info["min_date"]) > pd.to_datetime(end_date))
+        ]
+        if drop_files:
+            scans.append(f"SELECT {columns} FROM read_csv(?, header = true, union_by_name = true) WHERE {complete}")
+            params.append(drop_files)
+        return " UNION ALL BY NAME ".join(scans), params
+
+    def _query(self, snapshot, sql, params=(), start_date=None, end_date=None):
+        source, source_params = self._source(snapshot, start_date, end_date)
+        cursor = self._connection.cursor()
+        try:
+            return cursor.execute(f"WITH checkins AS ({source}) {sql}", source_params + list(params)).df()
+        finally:
+            cursor.close()
+
+    def route_operators(self, snapshot):
+        """Operator of each route by its earliest check-in, in route order, as the cube keeps it."""
+        with self._lock:
+            version, operators = self._route_operators
+        if version != snapshot.version:
+            frame = self._query(snapshot, """
+                SELECT "Route", arg_min("Operator", "Date" + to_hours("Hour")) AS "Operator"
+                FROM checkins GROUP BY "Route" ORDER BY "Route"
+            """)
+            operators = pd.Series(frame['Operator'].values, index=pd.Index(frame['Route'].tolist()), dtype=object)
+            with self._lock:
+                self._route_operators = (snapshot.version, operators)
+        return operators
+
+    @staticmethod
+    def _window(start_date, end_date, hour_start, hour_end):
+        conditions, params = ["true"], []
+        if start_date:
+            conditions.append('"Date" >= ?')
+            params.append(pd.to_datetime(start_date).to_pydatetime())
+        if end_date:
+            conditions.append('"Date" <= ?')
+            params.append(pd.to_datetime(end_date).to_pydatetime())
+        if hour_start is not None:
+            conditions.append('"Hour" >= ?')
+            params.append(hour_start)
+        if hour_end is not None:
+            conditions.append('"Hour" <= ?')
+            params.append(hour_end)
+        return " AND ".join(conditions), params
+
+    def analytics(self, snapshot, start_date=None, end_date=None, hour_start=None, hour_end=None,
+                  companies=None, routes=None, groupings=ANALYTICS_GROUPINGS):
+        operators = self.route_operators(snapshot)
+        selected = np.ones(len(operators), dtype=bool)
+        if companies:
+            selected &= operators.isin(companies).values
+        if routes:
+            selected &= operators.index.isin(routes)
+        operators = operators[selected]
+
+        where, params = self._window(start_date, end_date, hour_start, hour_end)
+        sums = ", ".join(f'CAST(sum("{col}") AS BIGINT) AS "{col}"' for col in COUNT_COLUMNS)
+        cells = self._query(snapshot, f"""
+            SELECT "Hour", "Route", {sums}, count(*) AS "Rows"
+            FROM checkins WHERE {where} GROUP BY "Hour", "Route"
+        """, params, start_date, end_date)
+        dates = []
+        if "dates" in groupings:
+            if not selected.all():
+                where += ' AND list_contains(?, "Route")'
+                params.append(operators.index.tolist())
+            dates = self._query(snapshot, f"""
+                SELECT DISTINCT strftime("Date", '%Y-%m-%d') AS "Day" FROM checkins WHERE {where}
+            """, params, start_date, end_date)['Day'].tolist()
+
+        hours = np.unique(cells['Hour'].values)
+        route_pos = operators.index.get_indexer(cells['Route'])
+        keep = route_pos >= 0
+        grid = np.zeros((CUBE_ROWS + 1, len(hours), len(operators)), dtype=np.int64)
+        grid[:, hours.searchsorted(cells['Hour'].values[keep]), route_pos[keep]] = (
+            cells[COUNT_COLUMNS + ['Rows']].to_numpy(dtype=np.int64)[keep].T
+        )
+        return rollup_analytics(grid, operators.index, operators, hours, dates, groupings)
+
+    def volume(self, snapshot, group_col):
+        sums = ", ".join(f'CAST(sum("{col}") AS BIGINT) AS "{col}"' for col in COUNT_COLUMNS)
+        return self._query(snapshot, f'SELECT "{group_col}", {sums} FROM checkins GROUP BY 1 ORDER BY 1')
+
+def make_query_engine(name=QUERY_ENGINE):
+    if name == "duckdb":
+        if duckdb is not None:
+            return DuckDBEngine()
+        print("DuckDB is not installed; using the pandas query engine")
+    elif name != "pandas":
+        print(f"Unknown query engine {name!r}; using the pandas query engine")
+    return PandasEngine()
+
+query_engine = make_query_engine()
+
+def checkin_records(df):
+    """Serialize check-in rows into registration records one column at a time."""
+    date_codes, unique_dates = pd.factorize(df['Date'])
+    iso_dates = np.array([date.isoformat() for date in unique_dates], dtype=object)
+    columns = {
+        "Date": iso_dates[date_codes].tolist(),
+        "Hour": df['Hour'].values.astype(np.int64).tolist(),
+        "Route": df['Route'].astype(str).tolist(),
+        "Total Count": df['Total Count'].values.astype(np.int64).tolist(),
+        "By SmartCard": df['By SmartCard'].values.astype(np.int64).tolist(),
+        "By QR": df['By QR'].values.astype(np.int64).tolist(),
+        "Number Of Busses": df['Number Of Busses'].values.astype(np.int64).tolist(),
+        "Operator": df['Operator'].astype(object).tolist()
+    }
+    keys = list(columns)
+    return [dict(zip(keys, row)) for row in zip(*columns.values())]
+
+def encode_json(payload):
+    if orjson is not None:
+        return orjson.dumps(payload)
+    return json.dumps(payload, separators=(',', ':')).encode()
+
+def json_response(payload):
+    return Response(content=encode_json(payload), media_type="application/json")
+
+ARROW_STREAM_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+
+def wants_arrow(request, format=None):
+    """Pick the Arrow IPC format from ?format=arrow or an Accept header; JSON stays the default."""
+    if format:
+        arrow = format == "arrow"
+    else:
+        arrow = ARROW_STREAM_MEDIA_TYPE in request.headers.get("accept", "")
+    if arrow and pa is None:
+        raise HTTPException(status_code=406, detail="Arrow responses need pyarrow installed")
+    return arrow
+
+def arrow_wire_type(arrow_type):
+    """The fixed wire type for a column, whatever narrow dtype the snapshot happens to hold."""
+    if pa.types.is_dictionary(arrow_type):
+        return pa.dictionary(pa.int32(), pa.string())
+    if pa.types.is_integer(arrow_type):
+        return pa.int64()
+    if pa.types.is_floating(arrow_type):
+        return pa.float64()
+    return arrow_type
+
+def arrow_ipc_bytes(df, metadata=None):
+    """Write a frame's columns as an Arrow IPC stream without building per-row objects.
+
+    Counters, hours and dictionary indices are widened to fixed types, so an
+    endpoint's schema does not change when an ingest or reload widens the
+    compact in-memory dtypes.
+    """
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    table = table.cast(pa.schema(
+        [pa.field(field.name, arrow_wire_type(field.type)) for field in table.schema], table.schema.metadata
+    ))
+    if metadata:
+        table = table.replace_schema_metadata({**(table.schema.metadata or {}), **metadata})
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+def arrow_response(content, headers=None):
+    return Response(content=content, media_type=ARROW_STREAM_MEDIA_TYPE, headers=headers)
+
+def frame_memory_mb(df):
+    return df.memory_usage(deep=True).sum() / 1024 ** 2
+
+def read_checkin_csv(csv_path=CHECKIN_CSV):
+    # Labels are always read as text: a file whose routes all look numeric
+    # would otherwise get integer labels that never match the string ones.
+    df = pd.read_csv(csv_path, dtype={'Route': str, 'Operator': str})
+    df['Date'] = pd.to_datetime(df['Date'])
+    return df
+
+class BusTotals:
+    """Dataset-wide sums of the counters per route, per operator and per hour.
+
+    Built once per load, then updated with only the new rows on every append
+    via appended(), so the totals endpoints never rescan the history.
+    """
+
+    def __init__(self, df):
+        self.by_route = df.groupby('Route', observed=True).agg(
+            {**{col: 'sum' for col in COUNT_COLUMNS}, 'Operator': 'first'}
+        ).astype({**{col: np.int64 for col in COUNT_COLUMNS}, 'Operator': object})
+        self.by_route.index = self.by_route.index.astype(object)
+        self.by_operator = df.groupby('Operator', observed=True)[COUNT_COLUMNS].sum().astype(np.int64)
+        self.by_operator.index = self.by_operator.index.astype(object)
+        self.by_hour = df.groupby('Hour')[COUNT_COLUMNS].sum().astype(np.int64)
+        self.by_hour.index = self.by_hour.index.astype(np.int64)
+        self.rows = len(df)
+        self.passengers = int(df['Total Count'].sum())
+
+    def appended(self, df):
+        new = BusTotals(df)
+        totals = BusTotals.__new__(BusTotals)
+        totals.by_route = self.by_route[COUNT_COLUMNS].add(new.by_route[COUNT_COLUMNS], fill_value=0).astype(np.int64)
+        totals.by_route['Operator'] = self.by_route['Operator'].combine_first(new.by_route['Operator'])
+        totals.by_operator = self.by_operator.add(new.by_operator, fill_value=0).astype(np.int64)
+        totals.by_hour = self.by_hour.add(new.by_hour, fill_value=0).astype(np.int64)
+        totals.rows = self.rows + new.rows
+        totals.passengers = self.passengers + new.passengers
+        return totals
+
+    def shared_state(self):
+        """JSON-serialisable form of the totals, for shared dataset segments."""
+        return {
+            "by_route": self.by_route.to_dict('split'),
+            "by_operator": self.by_operator.to_dict('split'),
+            "by_hour": self.by_hour.to_dict('split'),
+            "rows": self.rows,
+            "passengers": self.passengers
+        }
+
+    @classmethod
+    def from_shared_state(cls, state):
+        totals = cls.__new__(cls)
+        for key in ("by_route", "by_operator", "by_hour"):
+            split = state[key]
+            frame = pd.DataFrame(split["data"], index=pd.Index(split["index"], dtype=object), columns=split["columns"])
+            setattr(totals, key, frame.astype({col: np.int64 for col in COUNT_COLUMNS}))
+        totals.by_route['Operator'] = totals.by_route['Operator'].astype(object)
+        totals.by_hour.index = totals.by_hour.index.astype(np.int64)
+        totals.rows = state["rows"]
+        totals.passengers = state["passengers"]
+        return totals
+
+class DatasetSummary:
+    """Headline facts and the filter dimensions of a snapshot, ready to serve as they are.
+
+    Derived from the snapshot's totals and cube date axis, which appends
+    already update incrementally, so building one never reads rows.
+    """
+
+    def __init__(self, totals, cube):
+        start = pd.Timestamp(cube.dates[0]).isoformat() if len(cube.dates) else None
+        end = pd.Timestamp(cube.dates[-1]).isoformat() if len(cube.dates) else None
+        self.stats = {
+            "total_records": totals.rows,
+            "date_range": {"start": start, "end": end},
+            "routes_count": len(totals.by_route),
+            "operators": totals.by_operator.index.tolist(),
+            "total_passengers": totals.passengers
+        }
+        self.date_range = {"start": start, "end": end, "days": len(cube.dates)}
+        self.dimensions = {
+            "companies": sorted(totals.by_operator.index.tolist()),
+            "routes": sorted(totals.by_route.index.tolist()),
+            "hours": totals.by_hour.index.tolist(),
+            "dates": pd.DatetimeIndex(cube.dates).strftime('%Y-%m-%d').tolist()
+        }
+
+def append_checkins(df, rows):
+    """Concatenate two compact check-in frames, keeping sorted categories and the row order."""
+    df, rows = df.copy(deep=False), rows.copy(deep=False)
+    for col in CATEGORY_COLUMNS:
+        categories = df[col].cat.categories.union(rows[col].cat.categories)
+        if not df[col].cat.categories.equals(categories):
+            df[col] = df[col].cat.set_categories(categories)
+        if not rows[col].cat.categories.equals(categories):
+            rows[col] = rows[col].cat.set_categories(categories)
+    return sort_bus_data(pd.concat([df, rows], ignore_index=True))
+
+def freeze_arrays(*arrays):
+    for array in arrays:
+        array.flags.writeable = False
+
+class BusSnapshot:
+    """A loaded check-in frame together with everything derived from it.
+
+    Snapshots are never modified after construction. Handlers read the
+    module-level bus_snapshot reference once and use only that object, so a
+    reload can publish a new snapshot with a single assignment while
+    in-flight requests finish on the old one, without locks on the read path.
+
+    Because a snapshot is shared by every request, handlers work on slices
+    and views of it and never copy it up front. The frame is protected by
+    pandas copy-on-write and the derived NumPy arrays are marked read-only.
+
+    source is the signature of the base CSV the snapshot was built from, and
+    segment names the shared dataset segment it is mapped from, if any.
+    """
+
+    def __init__(self, data, version, cube=None, totals=None, ingested=None, index=None, source=None,
+                 segment=None, load_sketches=None):
+        self.data = data
+        self.cube = cube if cube is not None else BusCube(data)
+        self.totals = totals if totals is not None else BusTotals(data)
+        self.daily = DailyRollup(self.cube)
+        self.top_route_summaries = TopRouteSummaries(self.daily)
+        self.load_sketches = load_sketches if load_sketches is not None else LoadSketches(data)
+        self.summary = DatasetSummary(self.totals, self.cube)
+        self.index = index if index is not None else RowIndex(data)
+        self.sort_orders = SortOrders(data)
+        self.ingested = ingested or {}
+        self.version = version
+        self.source = source
+        self.segment = segment
+        freeze_arrays(self.cube.values, self.daily.values, self.load_sketches.by_route,
+                      self.load_sketches.by_hour, *self.index.arrays())
+
+    def appended(self, rows, version, ingested):
+        """Return a new snapshot with rows added; cube and totals are updated incrementally."""
+        return BusSnapshot(
+            append_checkins(self.data, rows),
+            version,
+            cube=self.cube.merged(BusCube(rows)),
+            totals=self.totals.appended(rows),
+            load_sketches=self.load_sketches.merged(LoadSketches(rows)),
+            ingested={**self.ingested, **ingested},
+            source=self.source
+        )
+
+snapshot_versions = itertools.count(1)
+reload_lock = threading.Lock()
+publish_lock = threading.RLock()
+reload_status = {"state": "idle", "started": None, "finished": None, "error": None}
+
+def current_snapshot():
+    snapshot = bus_snapshot
+    if snapshot is None:
+        raise HTTPException(status_code=503, detail="Bus data not loaded")
+    return snapshot
+
+def load_bus_data(rebuild=False):
+    """Load the base CSV plus the drop directory and publish the result.
+
+    In shared mode an up-to-date published segment is attached instead of
+    being rebuilt, unless rebuild is set.
+    """
+    with publish_lock:
+        loaded = load_shared_bus_data(rebuild) if SHARED_DATASET_DIR else load_base_bus_data()
+        if loaded:
+            # A bad drop file must not keep the base data from being served.
+            try:
+                ingest_new_checkin_files()
+            except Exception as e:
+                print(f"Error ingesting check-in files: {e}")
+        return loaded
+
+def build_base_snapshot(version):
+    started = time.perf_counter()
+    source_info = source_signature(CHECKIN_CSV)
+    df = read_checkin_cache()
+    source = "cache"
+    if df is None:
+        df = read_checkin_csv()
+        source = "csv"
+        before_mb = frame_memory_mb(df)
+        df = sort_bus_data(compact_bus_data(df))
+        print(f"✓ Compacted bus data from {before_mb:.1f} MB to {frame_memory_mb(df):.1f} MB")
+        write_checkin_cache(df)
+    snapshot = BusSnapshot(sort_bus_data(df), version, source=source_info)
+    elapsed = time.perf_counter() - started
+    print(f"✓ Loaded {len(snapshot.data)} bus records ({frame_memory_mb(snapshot.data):.1f} MB) from {source} in {elapsed:.2f}s (pid {os.getpid()}, version {snapshot.version})")
+    return snapshot
 
-def load_bus_data():
-    global bus_data
+def load_base_bus_data():
+    """Build the base snapshot, append the drop directory, and publish the result once.
+
+    Readers never see the base data without the ingested files, not even
+    for the duration of a reload.
+    """
+    global bus_snapshot
+    try:
+        snapshot = build_base_snapshot(next(snapshot_versions))
+    except Exception as e:
+        print(f"Error loading bus data: {e}")
+        return False
+    try:
+        snapshot = append_drop_files(snapshot, CHECKIN_DROP_DIR, next(snapshot_versions)) or snapshot
+    except Exception as e:
+        print(f"Error ingesting check-in files: {e}")
+    bus_snapshot = snapshot
+    return True
+
+CHECKIN_DROP_DIR = os.environ.get("AYNA_CHECKIN_DROP_DIR", "checkins_incoming")
+DROP_POLL_SECONDS = float(os.environ.get("AYNA_DROP_POLL_SECONDS", "60"))
+duplicate_drop_files = set()
+# (name, size, mtime_ns) of files that failed to parse; retried once they change.
+failed_drop_files = set()
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def ingest_new_checkin_files(drop_dir=CHECKIN_DROP_DIR):
+    """Append CSV files in drop_dir that the current snapshot has not ingested yet.
+
+    Files are identified by content hash, so a file that is copied in again,
+    even under another name, is skipped. Writers should move finished files
+    into the directory rather than writing them in place. The base CSV plus
+    every file in the drop directory make up the dataset, so a full reload
+    re-applies them.
+    """
+    global bus_snapshot
+    if not os.path.isdir(drop_dir):
+        return 0
+    with publish_lock, shared_dataset_lock():
+        sync_shared_snapshot()
+        snapshot = bus_snapshot
+        if snapshot is None:
+            return 0
+        appended = append_drop_files(snapshot, drop_dir, next(snapshot_versions))
+        if appended is None:
+            return 0
+        bus_snapshot = publish_snapshot(appended)
+        rows = len(appended.data) - len(snapshot.data)
+        if SHARED_DATASET_DIR:
+            del snapshot, appended
+            release_free_memory()
+        return rows
+
+def append_drop_files(snapshot, drop_dir, version):
+    """Return snapshot with the new files in drop_dir appended, or None if there are none."""
+    if not os.path.isdir(drop_dir):
+        return None
+    known = {(info["file"], info["size"], info["mtime_ns"]) for info in snapshot.ingested.values()}
+    new_rows, ingested = None, {}
+    for path in sorted(glob.glob(os.path.join(drop_dir, "*.csv"))):
+        name, stat = os.path.basename(path), os.stat(path)
+        signature = (name, stat.st_size, stat.st_mtime_ns)
+        if signature in known or signature in duplicate_drop_files or signature in failed_drop_files:
+            continue
+        digest = file_sha256(path)
+        if digest in snapshot.ingested or digest in ingested:
+            print(f"Skipping already ingested check-in file {name}")
+            duplicate_drop_files.add(signature)
+            continue
+        try:
+            rows = sort_bus_data(compact_bus_data(read_checkin_csv(path)))
+        except Exception as e:
+            print(f"Error ingesting {name}: {e}")
+            failed_drop_files.add(signature)
+            continue
+        new_rows = rows if new_rows is None else append_checkins(new_rows, rows)
+        ingested[digest] = {
+            "file": name,
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "rows": len(rows),
+            "min_date": rows['Date'].iloc[0].isoformat() if len(rows) else None,
+            "max_date": rows['Date'].iloc[-1].isoformat() if len(rows) else None,
+            "ingested_at": datetime.now().isoformat()
+        }
+    if new_rows is None:
+        return None
+    appended = snapshot.appended(new_rows, version, ingested)
+    print(f"✓ Appended {len(new_rows)} bus records from {len(ingested)} file(s) (version {appended.version})")
+    return appended
+
+def watch_drop_dir():
+    while True:
+        time.sleep(DROP_POLL_SECONDS)
+        try:
+            ingest_new_checkin_files()
+        except Exception as e:
+            print(f"Error scanning {CHECKIN_DROP_DIR}: {e}")
+
+# Published snapshots are memory-mapped from here, so a restart maps the rows
+# lazily instead of reading them all. Set it to an empty value to keep each
+# worker's snapshot private in memory.
+SHARED_DATASET_DIR = os.environ.get("AYNA_SHARED_DATASET_DIR", "shared_dataset") or None
+SHARED_POLL_SECONDS = float(os.environ.get("AYNA_SHARED_POLL_SECONDS", "2"))
+SHARED_SEGMENTS_KEPT = 2
+# Segments outlive restarts and upgrades. Bump this whenever the arrays or
+# labels a segment stores are computed differently, so older segments are
+# rebuilt instead of being read with the new meaning.
+SEGMENT_FORMAT = 1
+
+@contextmanager
+def shared_dataset_lock():
+    """Hold an exclusive lock across worker processes while the shared dataset changes.
+
+    Does nothing when AYNA_SHARED_DATASET_DIR is set to an empty value.
+    """
+    if not SHARED_DATASET_DIR:
+        yield
+        return
+    os.makedirs(SHARED_DATASET_DIR, exist_ok=True)
+    with open(os.path.join(SHARED_DATASET_DIR, ".lock"), "a+b") as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+def current_segment(root=SHARED_DATASET_DIR):
+    try:
+        with open(os.path.join(root, "CURRENT")) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+def read_segment_meta(name, root=SHARED_DATASET_DIR):
+    with open(os.path.join(root, name, "meta.json")) as f:
+        return json.load(f)
+
+def segment_is_current(name, root=SHARED_DATASET_DIR):
+    """Whether a segment has this release's format and was built from the current base CSV and drop files."""
+    meta = read_segment_meta(name, root)
+    if meta.get("format") != SEGMENT_FORMAT or meta["source"] != source_signature(CHECKIN_CSV):
+        return False
+    for info in meta["ingested"].values():
+        try:
+            stat = os.stat(os.path.join(CHECKIN_DROP_DIR, info["file"]))
+        except FileNotFoundError:
+            return False
+        if (stat.st_size, stat.st_mtime_ns) != (info["size"], info["mtime_ns"]):
+            return False
+    return True
+
+def write_shared_segment(snapshot, version, root=SHARED_DATASET_DIR):
+    """Write a snapshot as a directory of .npy arrays and make it the CURRENT segment.
+
+    Columns are stored one file per column (categoricals as their codes), next
+    to the cube and row index arrays, so workers can map every large array
+    instead of rebuilding it. Labels and ingestion state go in meta.json.
+    """
+    name = f"v{version:06d}-{os.urandom(4).hex()}"
+    path = os.path.join(root, name)
+    tmp_path = f"{path}.tmp"
+    os.makedirs(tmp_path)
+    df = snapshot.data
+    categories = {col: df[col].cat.categories.tolist() for col in df.columns
+                  if isinstance(df[col].dtype, pd.CategoricalDtype)}
+    arrays = {
+        f"column-{i}": df[col].values.codes if col in categories else df[col].values
+        for i, col in enumerate(df.columns)
+    }
+    cube_arrays, cube_labels = snapshot.cube.shared_state()
+    arrays.update({f"cube-{key}": array for key, array in cube_arrays.items()})
+    load_arrays, load_labels = snapshot.load_sketches.shared_state()
+    arrays.update({f"load-{key}": array for key, array in load_arrays.items()})
+    index_arrays = snapshot.index.arrays()
+    arrays.update({f"index-{i}": array for i, array in enumerate(index_arrays)})
+    for key, array in arrays.items():
+        np.save(os.path.join(tmp_path, f"{key}.npy"), np.ascontiguousarray(array))
+    meta = {
+        "format": SEGMENT_FORMAT,
+        "version": version,
+        "source": snapshot.source,
+        "ingested": snapshot.ingested,
+        "columns": df.columns.tolist(),
+        "categories": categories,
+        "cube": cube_labels,
+        "load_sketches": load_labels,
+        "index_arrays": len(index_arrays),
+        "totals": snapshot.totals.shared_state()
+    }
+    with open(os.path.join(tmp_path, "meta.json"), "w") as f:
+        json.dump(meta, f)
+    os.replace(tmp_path, path)
+
+    pointer_tmp = os.path.join(root, f"CURRENT.{os.getpid()}.tmp")
+    with open(pointer_tmp, "w") as f:
+        f.write(name)
+    os.replace(pointer_tmp, os.path.join(root, "CURRENT"))
+    prune_shared_segments(root)
+    return name
+
+def prune_shared_segments(root=SHARED_DATASET_DIR):
+    """Delete all but the newest segments; workers still mapping one keep their mapping."""
+    segments = sorted(name for name in os.listdir(root) if name.startswith("v"))
+    published = [name for name in segments if not name.endswith(".tmp")]
+    stale = [name for name in segments if name.endswith(".tmp")] + published[:-SHARED_SEGMENTS_KEPT]
+    for name in stale:
+        shutil.rmtree(os.path.join(root, name), ignore_errors=True)
+
+def attach_shared_segment(name, root=SHARED_DATASET_DIR):
+    """Build a snapshot over memory-mapped arrays of a published segment, without copying them."""
+    path = os.path.join(root, name)
+    meta = read_segment_meta(name, root)
+    if meta.get("format") != SEGMENT_FORMAT:
+        raise ValueError(f"segment {name} has format {meta.get('format')}, expected {SEGMENT_FORMAT}")
+
+    def load(key):
+        return np.load(os.path.join(path, f"{key}.npy"), mmap_mode='r').view(np.ndarray)
+
+    columns = {}
+    for i, col in enumerate(meta["columns"]):
+        values = load(f"column-{i}")
+        if col in meta["categories"]:
+            values = pd.Categorical.from_codes(values, categories=pd.Index(meta["categories"][col]), validate=False)
+        columns[col] = values
+    data = pd.DataFrame(columns, copy=False)
+    cube = BusCube.from_shared_state({"values": load("cube-values"), "dates": load("cube-dates")}, meta["cube"])
+    index = RowIndex.from_arrays(data, [load(f"index-{i}") for i in range(meta["index_arrays"])])
+    # The totals travel in the metadata, so attaching reads no row pages; the
+    # OS maps in only the stretches of the columns that queries touch.
+    totals = BusTotals.from_shared_state(meta["totals"])
+    load_sketches = LoadSketches.from_shared_state(
+        {key: load(f"load-{key}") for key in ("by-route", "by-hour", "months")}, meta["load_sketches"]
+    )
+    return BusSnapshot(data, meta["version"], cube=cube, totals=totals, index=index, ingested=meta["ingested"],
+                       source=meta["source"], segment=name, load_sketches=load_sketches)
+
+def publish_snapshot(snapshot):
+    """Return the snapshot to serve: snapshot itself, or in shared mode its newly written segment.
+
+    Callers hold shared_dataset_lock().
+    """
+    if not SHARED_DATASET_DIR:
+        return snapshot
+    previous = current_segment()
+    version = read_segment_meta(previous)["version"] + 1 if previous else 1
+    shared = attach_shared_segment(write_shared_segment(snapshot, version))
+    print(f"✓ Published shared bus data segment {shared.segment} (pid {os.getpid()}, version {shared.version})")
+    return shared
+
+def sync_shared_snapshot():
+    """Switch to the CURRENT segment if another worker has published a newer one."""
+    global bus_snapshot
+    if not SHARED_DATASET_DIR:
+        return
+    name = current_segment()
+    if name and (bus_snapshot is None or bus_snapshot.segment != name):
+        bus_snapshot = attach_shared_segment(name)
+        print(f"✓ Attached shared bus data segment {name} (pid {os.getpid()}, version {bus_snapshot.version})")
+        release_free_memory()
+
+def load_shared_bus_data(rebuild=False):
+    """Attach the published segment, first building and publishing one if it is missing or stale.
+
+    The first worker to take the lock parses the data and publishes it. The
+    others find a segment in this release's SEGMENT_FORMAT that is current
+    for the base CSV and drop files, and only map it.
+    """
+    global bus_snapshot
     try:
-        bus_data = pd.read_csv("ceck_in_buss.csv")
-        bus_data['Date'] = pd.to_datetime(bus_data['Date'])
-        print(f"✓ Loaded {len(bus_data)} bus records")
+        with shared_dataset_lock():
+            name = current_segment()
+            attached = False
+            if name and not rebuild and segment_is_current(name):
+                # A damaged segment, such as one with files removed, is rebuilt as well.
+                try:
+                    sync_shared_snapshot()
+                    attached = True
+                except Exception as e:
+                    print(f"Rebuilding unreadable shared bus data segment {name}: {e}")
+            if not attached:
+                snapshot = build_base_snapshot(next(snapshot_versions))
+                snapshot = append_drop_files(snapshot, CHECKIN_DROP_DIR, next(snapshot_versions)) or snapshot
+                bus_snapshot = publish_snapshot(snapshot)
+                del snapshot
+                release_free_memory()
         return True
     except Exception as e:
         print(f"Error loading bus data: {e}")
         return False
 
+def release_free_memory():
+    """Return memory freed after a private build to the OS, so the worker keeps only the mapping."""
+    gc.collect()
+    if pa is not None:
+        pa.default_memory_pool().release_unused()
+    try:
+        ctypes.CDLL("libc.so.6").malloc_trim(0)
+    except (OSError, AttributeError):
+        pass
+
+def watch_shared_dataset():
+    while True:
+        time.sleep(SHARED_POLL_SECONDS)
+        try:
+            with publish_lock:
+                sync_shared_snapshot()
+        except Exception as e:
+            print(f"Error attaching shared bus data: {e}")
+
+RESULT_CACHE_SIZE = int(os.environ.get("AYNA_RESULT_CACHE_SIZE", "256"))
+
+class ResultCache:
+    """Bounded LRU of endpoint results keyed by normalized filters.
+
+    Every key is tagged with the version of the snapshot it was computed from,
+    so results from before a reload are never served afterwards; they simply
+    age out of the LRU.
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def peek(self, version, key):
+        """Return the cached value, or None without counting a miss."""
+        with self._lock:
+            value = self._entries.get((version,) + key)
+            if value is not None:
+                self._entries.move_to_end((version,) + key)
+                self.hits += 1
+            return value
+
+    def get_or_compute(self, version, key, compute):
+        key = (version,) + key
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+        value = compute()
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return value
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "dataset_version": bus_snapshot.version if bus_snapshot is not None else None
+            }
+
+result_cache = ResultCache(RESULT_CACHE_SIZE)
+
+async def cached_query(version, key, compute):
+    """Answer cache hits on the event loop and compute misses on the query pool."""
+    value = result_cache.peek(version, key)
+    if value is None:
+        value = await query_pool.run(result_cache.get_or_compute, version, key, compute)
+    return value
+
+def normalize_date(value):
+    return pd.to_datetime(value).isoformat() if value else None
+
+def normalize_list(value):
+    return tuple(sorted(set(value.split(',')))) if value else None
+
+QUERY_WORKERS = int(os.environ.get("AYNA_QUERY_WORKERS", str(min(4, os.cpu_count() or 1))))
+QUERY_QUEUE_LIMIT = int(os.environ.get("AYNA_QUERY_QUEUE_LIMIT", "32"))
+
+class WorkerPool:
+    """Bounded thread pool that runs blocking handler work off the event loop.
+
+    At most `workers` jobs run at once and at most `queue_limit` more wait for
+    a thread; further submissions are refused with 503 instead of queueing
+    without bound. Threads share the published snapshot, and numpy/pandas
+    release the GIL in their inner loops, so the event loop keeps serving
+    cheap endpoints while queries run.
+    """
+
+    def __init__(self, name, workers, queue_limit):
+        self.name = name
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self._executor = None
+        self._lock = threading.Lock()
+        self.queued = 0
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.cancelled = 0
+        self.rejected = 0
+        self._waits = deque(maxlen=1024)
+        self._runs = deque(maxlen=1024)
+
+    async def run(self, func, *args):
+        with self._lock:
+            if self.queued >= self.queue_limit:
+                self.rejected += 1
+                raise HTTPException(status_code=503, detail=f"{self.name} queue is full",
+                                    headers={"Retry-After": "1"})
+            self.queued += 1
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=self.name)
+            executor = self._executor
+        future = executor.submit(self._call, time.perf_counter(), func, args)
+        future.add_done_callback(self._discard_cancelled)
+        return await asyncio.wrap_future(future)
+
+    def _call(self, submitted, func, args):
+        started = time.perf_counter()
+        with self._lock:
+            self.queued -= 1
+            self.running += 1
+            self._waits.append(started - submitted)
+        ok = False
+        try:
+            result = func(*args)
+            ok = True
+            return result
+        finally:
+            with self._lock:
+                self.running -= 1
+                self.completed += ok
+                self.failed += not ok
+                self._runs.append(time.perf_counter() - started)
+
+    def _discard_cancelled(self, future):
+        # A job cancelled before a thread picked it up never reaches _call.
+        if future.cancelled():
+            with self._lock:
+                self.queued -= 1
+                self.cancelled += 1
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self):
+        with self._lock:
+            waits = np.array(self._waits) * 1000
+            runs = np.array(self._runs) * 1000
+            return {
+                "workers": self.workers,
+                "running": self.running,
+                "queued": self.queued,
+                "queue_limit": self.queue_limit,
+                "completed": self.completed,
+                "failed": self.failed,
+                "cancelled": self.cancelled,
+                "rejected": self.rejected,
+                "wait_ms": latency_summary(waits),
+                "run_ms": latency_summary(runs)
+            }
+
+def latency_summary(ms):
+    if len(ms) == 0:
+        return {"p50": 0.0, "p95": 0.0, "max": 0.0}
+    p50, p95 = np.percentile(ms, [50, 95])
+    return {"p50": round(float(p50), 2), "p95": round(float(p95), 2), "max": round(float(ms.max()), 2)}
+
+query_pool = WorkerPool("query", QUERY_WORKERS, QUERY_QUEUE_LIMIT)
+# Slow network and file jobs get their own single thread so they neither
+# occupy query workers nor run concurrently with each other.
+background_pool = WorkerPool("background", 1, 4)
+
+GEO_DATA_FILE = "zone_attributes_synthetic.gpkg"
+LIVE_ROUTE_FILES = ["pois.csv", "bus_stops.csv", "bus_routes.csv", "bus_route_paths.csv"]
+
 def load_geo_data():
-    global geo_data
+    global geo_data, geo_data_source
     try:
-        geo_data = gpd.read_file("zone_attributes_synthetic.gpkg")
+        geo_data = gpd.read_file(GEO_DATA_FILE)
+        geo_data_source = source_signature(GEO_DATA_FILE)
         print(f"✓ Loaded {len(geo_data)} geographic zones")
         return True
     except Exception as e:
         print(f"Error loading geo data: {e}")
         return False
 
+def bus_dataset_tag():
+    snapshot = bus_snapshot
+    if snapshot is None:
+        return None
+    return [snapshot.version, snapshot.source, sorted(snapshot.ingested)]
+
+def geo_dataset_tag():
+    return geo_data_source if geo_data is not None else None
+
+def live_routes_tag():
+    return [source_signature(path) if os.path.exists(path) else None for path in LIVE_ROUTE_FILES]
+
+# Read endpoints by path prefix, with what identifies the data they serve.
+ETAG_DATASETS = [
+    ("/api/bus/", bus_dataset_tag),
+    ("/api/ingest", bus_dataset_tag),
+    ("/api/date-range", bus_dataset_tag),
+    ("/api/demographics/", geo_dataset_tag),
+    ("/api/routes/live", live_routes_tag),
+]
+
+def normalized_query(request):
+    """Query parameters keyed the way the handlers read them, so equivalent spellings match.
+
+    Lists are compared as sets and dates by the day they name, e.g.
+    companies=Qala,Sahil and companies=Sahil,Qala give the same items.
+    """
+    normalizers = {
+        "start_date": normalize_date, "end_date": normalize_date, "companies": normalize_list,
+        "routes": normalize_list, "include": normalize_list, "quantiles": parse_quantiles
+    }
+    query = []
+    for key, value in request.query_params.multi_items():
+        if value == "":
+            continue
+        if key in normalizers:
+            try:
+                value = str(normalizers[key](value))
+            except Exception:
+                # The handler rejects the value, and error responses carry no ETag.
+                pass
+        query.append((key, value))
+    return sorted(query)
+
+def dataset_etag(request):
+    """Strong ETag of a read request: its dataset tag plus the normalized path and query, or None."""
+    tag = next((dataset() for prefix, dataset in ETAG_DATASETS if request.url.path.startswith(prefix)), None)
+    if tag is None:
+        return None
+    query = normalized_query(request)
+    arrow = ARROW_STREAM_MEDIA_TYPE in request.headers.get("accept", "")
+    key = json.dumps([tag, request.url.path, query, arrow], default=str)
+    return '"' + hashlib.sha256(key.encode()).hexdigest()[:32] + '"'
+
+def etag_matches(if_none_match, etag):
+    if not if_none_match:
+        return False
+    candidates = [candidate.strip() for candidate in if_none_match.split(",")]
+    return "*" in candidates or etag in (candidate.removeprefix("W/") for candidate in candidates)
+
+@app.middleware("http")
+async def conditional_get(request: Request, call_next):
+    """Tag dataset reads with an ETag and answer a matching If-None-Match with 304.
+
+    The tag changes whenever a new snapshot is published or the geo and
+    live route files change, so a match is answered before the handler
+    runs, without touching the data.
+    """
+    etag = dataset_etag(request) if request.method in ("GET", "HEAD") else None
+    if etag is None:
+        return await call_next(request)
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    response = await call_next(request)
+    if response.status_code == 200:
+        response.headers["ETag"] = etag
+    return response
+
+# Endpoints that answer JSON or Arrow from the same URL, picked by wants_arrow().
+ARROW_ENDPOINTS = {
+    "/api/bus/registrations", "/api/bus/analytics", "/api/bus/volume", "/api/bus/timeseries",
+    "/api/bus/load-distribution"
+}
+
+@app.middleware("http")
+async def vary_on_accept(request: Request, call_next):
+    """Mark negotiated responses with Vary: Accept, so shared caches keep JSON and Arrow apart.
+
+    Registered after conditional_get so 304 answers carry it as well.
+    """
+    response = await call_next(request)
+    if request.url.path in ARROW_ENDPOINTS:
+        vary = response.headers.get("vary")
+        if not vary:
+            response.headers["Vary"] = "Accept"
+        elif "accept" not in (value.strip().lower() for value in vary.split(",")):
+            response.headers["Vary"] = f"{vary}, Accept"
+    return response
+
+# Registered after the middlewares above so it is the outermost one and also
+# adds its headers to 304 answers.
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["*"],
+    allow_credentials=True,
+    allow_methods=["*"],
+    allow_headers=["*"],
+)
+
 @app.on_event("startup")
 async def startup_event():
     load_bus_data()
     load_geo_data()
+    if DROP_POLL_SECONDS > 0:
+        threading.Thread(target=watch_drop_dir, name="checkin-drop-watcher", daemon=True).start()
+    if SHARED_DATASET_DIR and SHARED_POLL_SECONDS > 0:
+        threading.Thread(target=watch_shared_dataset, name="shared-dataset-watcher", daemon=True).start()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    query_pool.shutdown()
+    background_pool.shutdown()
 
 @app.get("/health")
 async def health_check():
     return {
         "status": "healthy",
-        "bus_data_loaded": bus_data is not None,
+        "bus_data_loaded": bus_snapshot is not None,
+        "dataset_version": bus_snapshot.version if bus_snapshot is not None else None,
+        "dataset_segment": bus_snapshot.segment if bus_snapshot is not None else None,
+        "reload": reload_status["state"],
+        "query_queue": query_pool.queued,
+        "query_engine": query_engine.name,
         "geo_data_loaded": geo_data is not None,
         "timestamp": datetime.now().isoformat()
     }
 
 @app.get("/api/bus/registrations")
 async def get_bus_registrations(
+    request: Request,
     route: Optional[str] = None,
     operator: Optional[str] = None,
     start_date: Optional[str] = None,
     end_date: Optional[str] = None,
+    hour_start: Optional[int] = None,
+    hour_end: Optional[int] = None,
+    search: Optional[str] = None,
+    sort: Optional[str] = Query(default=None, pattern=f"^({'|'.join(SORTABLE_COLUMNS)})$"),
+    order: str = Query(default="asc", pattern="^(asc|desc)$"),
     limit: int = Query(default=1000, le=10000),
-    offset: int = Query(default=0, ge=0)
+    offset: int = Query(default=0, ge=0),
+    cursor: Optional[str] = None,
+    format: Optional[str] = Query(default=None, pattern="^(json|arrow)$")
 ):
-    if bus_data is None:
-        raise HTTPException(status_code=503, detail="Bus data not loaded")
+    snapshot = current_snapshot()
+    if sort and cursor:
+        raise HTTPException(status_code=400, detail="cursor pagination only supports the default order")
+    return await query_pool.run(
+        query_registrations, snapshot, wants_arrow(request, format), route, operator, start_date, end_date,
+        hour_start, hour_end, search, sort, order, limit, offset, cursor
+    )
+
+def query_registrations(snapshot, arrow, route, operator, start_date, end_date, hour_start, hour_end,
+                        search, sort, order, limit, offset, cursor):
+    bus_data = snapshot.data
+    positions = select_positions(bus_data, snapshot.index, route, operator, start_date, end_date)
+    positions = filter_positions(bus_data, positions, hour_start, hour_end, search)
+    if sort:
+        positions = sort_positions(bus_data, snapshot.sort_orders, positions, sort, order == "desc")
+    elif cursor:
+        after = decode_cursor(bus_data, cursor)
+        if isinstance(positions, range):
+            offset = min(max(after - positions.start, 0), len(positions))
+        else:
+            offset = int(positions.searchsorted(after))
     
-    df = bus_data.copy()
-    if route:
-        df = df[df['Route'] == route]
-    if operator:
-        df = df[df['Operator'] == operator]
-    if start_date:
-        df = df[df['Date'] >= pd.to_datetime(start_date)]
-    if end_date:
-        df = df[df['Date'] <= pd.to_datetime(end_date)]
-    
-    df = df.iloc[offset:offset + limit]
-    
-    records = []
-    for _, row in df.iterrows():
-        records.append({
-            "Date": row['Date'].isoformat(),
-            "Hour": int(row['Hour']),
-            "Route": str(row['Route']),
-            "Total Count": int(row['Total Count']),
-            "By SmartCard": int(row['By SmartCard']),
-            "By QR": int(row['By QR']),
-            "Number Of Busses": int(row['Number Of Busses']),
-            "Operator": row['Operator']
-        })
+    page = positions[offset:offset + limit]
+    df = bus_data.iloc[page]
+    has_more = offset + limit < len(positions)
+    next_cursor = encode_cursor(bus_data, page[-1]) if len(page) and has_more and not sort else None
     
-    return {"data": records, "total": len(bus_data)}
+    if arrow:
+        headers = {"X-Total-Count": str(len(positions))}
+        if next_cursor:
+            headers["X-Next-Cursor"] = next_cursor
+        return arrow_response(arrow_ipc_bytes(df), headers)
+    return json_response({"data": checkin_records(df), "total": len(positions), "next_cursor": next_cursor})
+
+EXPORT_CHUNK_ROWS = 50_000
+EXPORT_MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+def export_chunks(df, positions, fmt, chunk_rows=EXPORT_CHUNK_ROWS):
+    """Yield the selected rows as NDJSON or CSV, chunk_rows rows at a time."""
+    for start in range(0, len(positions), chunk_rows):
+        chunk = df.iloc[positions[start:start + chunk_rows]]
+        if fmt == "csv":
+            yield chunk.to_csv(index=False, header=start == 0, date_format='%Y-%m-%dT%H:%M:%S').encode()
+        else:
+            yield b"".join(encode_json(record) + b"\n" for record in checkin_records(chunk))
+    if fmt == "csv" and len(positions) == 0:
+        yield df.iloc[:0].to_csv(index=False).encode()
+
+def select_export_positions(snapshot, route, operator, start_date, end_date, hour_start, hour_end, search):
+    positions = select_positions(snapshot.data, snapshot.index, route, operator, start_date, end_date)
+    return filter_positions(snapshot.data, positions, hour_start, hour_end, search)
+
+@app.get("/api/bus/export")
+async def export_bus_registrations(
+    route: Optional[str] = None,
+    operator: Optional[str] = None,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    hour_start: Optional[int] = None,
+    hour_end: Optional[int] = None,
+    search: Optional[str] = None,
+    format: str = Query(default="ndjson", pattern="^(ndjson|csv)$")
+):
+    snapshot = current_snapshot()
+    df = snapshot.data
+    positions = await query_pool.run(
+        select_export_positions, snapshot, route, operator, start_date, end_date, hour_start, hour_end, search
+    )
+    return StreamingResponse(
+        export_chunks(df, positions, format),
+        media_type=EXPORT_MEDIA_TYPES[format],
+        headers={
+            "Content-Disposition": f'attachment; filename="checkins.{format}"',
+            "X-Total-Count": str(len(positions))
+        }
+    )
 
 @app.get("/api/bus/stats")
 async def get_bus_stats():
-    if bus_data is None:
-        raise HTTPException(status_code=503, detail="Bus data not loaded")
-    
-    return {
-        "total_records": len(bus_data),
-        "date_range": {
-            "start": bus_data['Date'].min().isoformat(),
-            "end": bus_data['Date'].max().isoformat()
-        },
-        "routes_count": bus_data['Route'].nunique(),
-        "operators": bus_data['Operator'].unique().tolist(),
-        "total_passengers": int(bus_data['Total Count'].sum())
-    }
+    return current_snapshot().summary.stats
+
+@app.get("/api/date-range")
+async def get_date_range():
+    return current_snapshot().summary.date_range
+
+# The groupings each analytics response section is built from.
+ANALYTICS_SECTIONS = {
+    "kpis": {"totals", "by_hour", "by_company"},
+    "by_company": {"by_company"},
+    "by_route": {"by_route"},
+    "by_hour": {"by_hour"},
+    "top_routes": {"by_route"},
+    "bottom_routes": {"by_route"},
+    "dropdowns": {"by_company", "by_route", "by_hour", "dates"},
+}
+
+def analytics_sections(include=None, dropdowns=True):
+    """Validate include= into the ordered tuple of sections to build; None means all of them."""
+    sections = normalize_list(include) or list(ANALYTICS_SECTIONS)
+    unknown = sorted(set(sections) - set(ANALYTICS_SECTIONS))
+    if unknown:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown analytics sections {unknown}; choose from {list(ANALYTICS_SECTIONS)}"
+        )
+    if include and not dropdowns and "dropdowns" in sections:
+        raise HTTPException(status_code=400, detail="include=dropdowns contradicts dropdowns=false")
+    return tuple(section for section in ANALYTICS_SECTIONS
+                 if section in sections and (dropdowns or section != "dropdowns"))
 
 @app.get("/api/bus/analytics")
 async def get_bus_analytics(
+    request: Request,
     start_date: Optional[str] = None,
     end_date: Optional[str] = None,
     hour_start: Optional[int] = None,
     hour_end: Optional[int] = None,
     companies: Optional[str] = None,
-    routes: Optional[str] = None
+    routes: Optional[str] = None,
+    approx: bool = False,
+    dropdowns: bool = True,
+    include: Optional[str] = None,
+    format: Optional[str] = Query(default=None, pattern="^(json|arrow)$")
 ):
-    if bus_data is None:
-        raise HTTPException(status_code=503, detail="Bus data not loaded")
-    
-    df = bus_data.copy()
-    
-    if start_date:
-        df = df[df['Date'] >= pd.to_datetime(start_date)]
-    if end_date:
-        df = df[df['Date'] <= pd.to_datetime(end_date)]
-    if hour_start is not None:
-        df = df[df['Hour'] >= hour_start]
-    if hour_end is not None:
-        df = df[df['Hour'] <= hour_end]
-    if companies:
-        company_list = companies.split(',')
-        df = df[df['Operator'].isin(company_list)]
-    if routes:
-        route_list = routes.split(',')
-        df = df[df['Route'].isin(route_list)]
-    
-    total_passengers = int(df['Total Count'].sum())
-    total_buses = int(df['Number Of Busses'].sum())
-    avg_pass_per_bus = total_passengers / total_buses if total_buses > 0 else 0
-    
-    hourly = df.groupby('Hour')['Total Count'].sum()
-    peak_hour = int(hourly.idxmax()) if len(hourly) > 0 else 0
+    snapshot = current_snapshot()
+    sections = analytics_sections(include, dropdowns)
     
-    by_company = df.groupby('Operator').agg({
-        'Total Count': 'sum',
-        'Number Of Busses': 'sum'
-    })
-    by_company['pass_per_bus'] = by_company['Total Count'] / by_company['Number Of Busses']
-    most_efficient = by_company['pass_per_bus'].idxmax() if len(by_company) > 0 else "N/A"
-    
-    by_company_payment = df.groupby('Operator').agg({
-        'By SmartCard': 'sum',
-        'Total Count': 'sum'
-    })
-    by_company_payment['smartcard_pct'] = (by_company_payment['By SmartCard'] / by_company_payment['Total Count'] * 100)
-    payment_leader = by_company_payment['smartcard_pct'].idxmax() if len(by_company_payment) > 0 else "N/A"
-    
-    company_agg = df.groupby('Operator').agg({
-        'Total Count': 'sum',
-        'Number Of Busses': 'sum',
-        'By SmartCard': 'sum',
-        'By QR': 'sum'
-    }).reset_index()
-    company_agg['pass_per_bus'] = company_agg['Total Count'] / company_agg['Number Of Busses']
-    
-    route_agg = df.groupby('Route').agg({
-        'Total Count': 'sum',
-        'Number Of Busses': 'sum',
-        'By SmartCard': 'sum',
-        'By QR': 'sum',
-        'Operator': 'first'
-    }).reset_index()
-    route_agg['pass_per_bus'] = route_agg['Total Count'] / route_agg['Number Of Busses']
-    
-    hour_agg = df.groupby('Hour').agg({
-        'Total Count': 'sum',
-        'Number Of Busses': 'sum',
-        'By SmartCard': 'sum',
-        'By QR': 'sum'
-    }).reset_index()
-    hour_agg['pass_per_bus'] = hour_agg['Total Count'] / hour_agg['Number Of Busses']
-    
-    top_routes = route_agg.nlargest(15, 'Total Count')
-    bottom_routes = route_agg.nsmallest(5, 'pass_per_bus')
-    
-    unique_companies = sorted(df['Operator'].unique().tolist())
-    unique_routes = sorted(df['Route'].unique().tolist())
-    unique_hours = sorted(df['Hour'].unique().tolist())
-    unique_dates = sorted(df['Date'].dt.strftime('%Y-%m-%d').unique().tolist())
+    filters = (
+        normalize_date(start_date), normalize_date(end_date), hour_start, hour_end,
+        normalize_list(companies), normalize_list(routes)
+    )
+    if wants_arrow(request, format):
+        return arrow_response(await cached_query(
+            snapshot.version, ("analytics-by-route-arrow",) + filters,
+            lambda: arrow_ipc_bytes(query_engine.analytics(snapshot, *filters, groupings={"by_route"})['by_route'])
+        ))
+    return await cached_query(
+        snapshot.version, ("analytics", approx, sections) + filters,
+        lambda: build_bus_analytics(snapshot, *filters, approx, sections)
+    )
+
+def build_bus_analytics(snapshot, start_date, end_date, hour_start, hour_end, companies, routes, approx=False,
+                        sections=tuple(ANALYTICS_SECTIONS)):
+    """Build the requested analytics sections, computing only the groupings they depend on."""
+    # The top route summaries cover every hour and route, so only a date window can
+    # be answered from them; other filters keep the exact ranking.
+    approx_top = approx and hour_start is None and hour_end is None and not companies and not routes
+    groupings = set()
+    for section in sections:
+        if not (section == "top_routes" and approx_top):
+            groupings |= ANALYTICS_SECTIONS[section]
+    agg = query_engine.analytics(
+        snapshot, start_date, end_date, hour_start, hour_end, companies, routes, groupings=groupings
+    ) if groupings else {}
     
-    return {
-        "kpis": {
-            "total_passengers": total_passengers,
-            "total_buses": total_buses,
-            "avg_pass_per_bus": round(avg_pass_per_bus, 1),
-            "peak_hour": peak_hour,
-            "most_efficient_company": most_efficient,
-            "payment_leader": payment_leader
-        },
-        "by_company": company_agg.to_dict('records'),
-        "by_route": route_agg.to_dict('records'),
-        "by_hour": hour_agg.to_dict('records'),
-        "top_routes": top_routes.to_dict('records'),
-        "bottom_routes": bottom_routes.to_dict('records'),
-        "dropdowns": {
-            "companies": unique_companies,
-            "routes": unique_routes,
-            "hours": unique_hours,
-            "dates": unique_dates
+    builders = {
+        "kpis": lambda: analytics_kpis(agg),
+        "by_company": lambda: agg['by_company'].to_dict('records'),
+        "by_route": lambda: agg['by_route'].to_dict('records'),
+        "by_hour": lambda: agg['by_hour'].to_dict('records'),
+        "top_routes": lambda: (
+            snapshot.top_route_summaries.top_routes(15, start_date, end_date) if approx_top
+            else agg['by_route'].nlargest(15, 'Total Count')
+        ).to_dict('records'),
+        "bottom_routes": lambda: agg['by_route'].nsmallest(5, 'pass_per_bus').to_dict('records'),
+        "dropdowns": lambda: {
+            "companies": sorted(agg['by_company']['Operator'].tolist()),
+            "routes": sorted(agg['by_route']['Route'].tolist()),
+            "hours": agg['by_hour']['Hour'].tolist(),
+            "dates": agg['dates']
         }
     }
+    return {section: builders[section]() for section in sections}
+
+@app.get("/api/bus/dimensions")
+async def get_bus_dimensions():
+    return current_snapshot().summary.dimensions
 
 @app.get("/api/bus/routes")
-async def get_bus_routes():
-    if bus_data is None:
-        raise HTTPException(status_code=503, detail="Bus data not loaded")
+async def get_bus_routes(approx: bool = False):
+    if approx:
+        return current_snapshot().top_route_summaries.top_routes(20).to_dict('records')
     
-    route_agg = bus_data.groupby('Route').agg({
-        'Total Count': 'sum',
-        'Number Of Busses': 'sum',
-        'Operator': 'first'
-    }).reset_index()
+    by_route = current_snapshot().totals.by_route
+    
+    route_agg = by_route[['Total Count', 'Number Of Busses', 'Operator']].rename_axis('Route').reset_index()
     
     return route_agg.nlargest(20, 'Total Count').to_dict('records')
 
 @app.get("/api/bus/operators")
 async def get_bus_operators():
-    if bus_data is None:
-        raise HTTPException(status_code=503, detail="Bus data not loaded")
+    by_operator = current_snapshot().totals.by_operator
     
-    operator_agg = bus_data.groupby('Operator').agg({
-        'Total Count': 'sum',
-        'Number Of Busses': 'sum'
-    }).reset_index()
+    operator_agg = by_operator[['Total Count', 'Number Of Busses']].rename_axis('Operator').reset_index()
     operator_agg.columns = ['Operator', 'Total_Passengers', 'Total_Buses']
     
     return operator_agg.to_dict('records')
 
 @app.get("/api/bus/volume")
-async def get_bus_volume(group_by: str = "route"):
-    if bus_data is None:
-        raise HTTPException(status_code=503, detail="Bus data not loaded")
+async def get_bus_volume(
+    request: Request,
+    group_by: str = "route",
+    format: Optional[str] = Query(default=None, pattern="^(json|arrow)$")
+):
+    snapshot = current_snapshot()
     
     if group_by == "route":
         group_col = 'Route'
@@ -256,25 +2247,29 @@ async def get_bus_volume(group_by: str = "route"):
     else:
         group_col = 'Route'
     
-    volume_agg = bus_data.groupby(group_col).agg({
-        'Total Count': 'sum',
-        'By SmartCard': 'sum',
-        'By QR': 'sum',
-        'Number Of Busses': 'sum'
-    }).reset_index()
-    
-    return volume_agg.to_dict('records')
+    if wants_arrow(request, format):
+        return arrow_response(await cached_query(
+            snapshot.version, ("volume-arrow", group_col),
+            lambda: arrow_ipc_bytes(query_engine.volume(snapshot, group_col))
+        ))
+    return await cached_query(
+        snapshot.version, ("volume", group_col),
+        lambda: query_engine.volume(snapshot, group_col).to_dict('records')
+    )
 
 @app.get("/api/bus/hourly-trend")
 async def get_hourly_trend(route: Optional[str] = None):
-    if bus_data is None:
-        raise HTTPException(status_code=503, detail="Bus data not loaded")
+    snapshot = current_snapshot()
     
-    df = bus_data.copy()
-    
-    if route:
-        df = df[df['Route'] == route]
+    return await cached_query(
+        snapshot.version, ("hourly-trend", route or None), lambda: build_hourly_trend(snapshot, route)
+    )
+
+def build_hourly_trend(snapshot, route):
+    if not route:
+        return snapshot.totals.by_hour[COUNT_COLUMNS].rename_axis('Hour').reset_index().to_dict('records')
     
+    df = snapshot.data.iloc[snapshot.index.positions('Route', route)]
     hourly = df.groupby('Hour').agg({
         'Total Count': 'sum',
         'By SmartCard': 'sum',
@@ -284,6 +2279,124 @@ async def get_hourly_trend(route: Optional[str] = None):
     
     return hourly.to_dict('records')
 
+@app.get("/api/bus/timeseries")
+async def get_bus_timeseries(
+    request: Request,
+    interval: str = Query(default="day", pattern=f"^({'|'.join(SERIES_INTERVALS)})$"),
+    split: Optional[str] = Query(default=None, pattern="^(route|operator)$"),
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    companies: Optional[str] = None,
+    routes: Optional[str] = None,
+    format: Optional[str] = Query(default=None, pattern="^(json|arrow)$")
+):
+    snapshot = current_snapshot()
+    
+    filters = (
+        interval, split, normalize_date(start_date), normalize_date(end_date),
+        normalize_list(companies), normalize_list(routes)
+    )
+    if wants_arrow(request, format):
+        return arrow_response(await cached_query(
+            snapshot.version, ("timeseries-arrow",) + filters,
+            lambda: arrow_ipc_bytes(snapshot.daily.series(*filters))
+        ))
+    return await cached_query(
+        snapshot.version, ("timeseries",) + filters, lambda: snapshot.daily.series(*filters).to_dict('records')
+    )
+
+def parse_quantiles(value):
+    try:
+        quantiles = tuple(sorted({float(q) for q in value.split(",") if q.strip()}))
+    except ValueError:
+        quantiles = ()
+    if not quantiles or not all(0 <= q <= 1 for q in quantiles):
+        raise HTTPException(status_code=400, detail="quantiles must be comma-separated numbers between 0 and 1")
+    return quantiles
+
+@app.get("/api/bus/load-distribution")
+async def get_load_distribution(
+    request: Request,
+    group_by: str = Query(default="route", pattern="^(route|hour)$"),
+    quantiles: str = "0.5,0.9,0.99",
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    hour_start: Optional[int] = None,
+    hour_end: Optional[int] = None,
+    companies: Optional[str] = None,
+    routes: Optional[str] = None,
+    format: Optional[str] = Query(default=None, pattern="^(json|arrow)$")
+):
+    snapshot = current_snapshot()
+    
+    filters = (
+        group_by, parse_quantiles(quantiles), normalize_date(start_date), normalize_date(end_date),
+        hour_start, hour_end, normalize_list(companies), normalize_list(routes)
+    )
+    if wants_arrow(request, format):
+        return arrow_response(await cached_query(
+            snapshot.version, ("load-distribution-arrow",) + filters,
+            lambda: arrow_ipc_bytes(load_distribution(snapshot, *filters))
+        ))
+    return await cached_query(
+        snapshot.version, ("load-distribution",) + filters,
+        lambda: load_distribution(snapshot, *filters).to_dict('records')
+    )
+
+def reload_bus_data():
+    """Rebuild the bus snapshot in the background and publish it with one reference swap."""
+    reload_status.update(state="running", started=datetime.now().isoformat(), finished=None, error=None)
+    try:
+        loaded = load_bus_data(rebuild=True)
+        reload_status.update(state="idle" if loaded else "failed", error=None if loaded else "see server log")
+    except Exception as e:
+        reload_status.update(state="failed", error=str(e))
+    finally:
+        reload_status["finished"] = datetime.now().isoformat()
+        reload_lock.release()
+
+@app.post("/api/reload-data", status_code=202)
+async def reload_data():
+    if not reload_lock.acquire(blocking=False):
+        return {"status": "already_running", "reload": dict(reload_status)}
+    threading.Thread(target=reload_bus_data, name="bus-data-reload", daemon=True).start()
+    return {
+        "status": "started",
+        "dataset_version": bus_snapshot.version if bus_snapshot is not None else None
+    }
+
+@app.get("/api/reload-data")
+async def get_reload_status():
+    return {
+        "reload": dict(reload_status),
+        "dataset_version": bus_snapshot.version if bus_snapshot is not None else None
+    }
+
+@app.post("/api/ingest")
+async def ingest_checkin_files():
+    appended = await background_pool.run(ingest_new_checkin_files)
+    return {
+        "appended_rows": appended,
+        "dataset_version": bus_snapshot.version if bus_snapshot is not None else None
+    }
+
+@app.get("/api/ingest")
+async def get_ingested_files():
+    snapshot = current_snapshot()
+    return {
+        "drop_dir": CHECKIN_DROP_DIR,
+        "files": sorted(snapshot.ingested.values(), key=lambda info: info["ingested_at"]),
+        "dataset_version": snapshot.version
+    }
+
+@app.get("/api/cache/stats")
+async def get_cache_stats():
+    return result_cache.stats()
+
+@app.get("/api/pool/stats")
+async def get_pool_stats():
+    return {"query": query_pool.stats(), "background": background_pool.stats()}
+
 @app.get("/api/demographics/{region_type}")
 async def get_demographics(
     region_type: str = PathParam(..., regex="^(micro|meso|macro)$")
@@ -291,6 +2404,9 @@ async def get_demographics(
     if geo_data is None:
         raise HTTPException(status_code=503, detail="Geo data not loaded")
     
+    return await query_pool.run(build_demographics, geo_data, region_type)
+
+def build_demographics(geo_data, region_type):
     region_column_map = {
         "micro": "MICRO",
         "meso": "MESO",
@@ -333,6 +2449,9 @@ async def get_demographics_stats(
     if geo_data is None:
         raise HTTPException(status_code=503, detail="Geo data not loaded")
     
+    return await query_pool.run(build_demographics_stats, geo_data, region_type)
+
+def build_demographics_stats(geo_data, region_type):
     region_column_map = {
         "micro": "MICRO",
         "meso": "MESO",
@@ -492,6 +2611,9 @@ def fetch_and_save_route_data():
 
 @app.get("/api/routes/live")
 async def get_live_routes():
+    return await query_pool.run(read_live_routes)
+
+def read_live_routes():
     try:
         df_pois = pd.read_csv("pois.csv")
         df_stops = pd.read_csv("bus_stops.csv")
@@ -524,12 +2646,14 @@ async def get_live_routes():
 @app.post("/api/routes/refresh")
 async def refresh_route_data():
     try:
-        result = fetch_and_save_route_data()
+        result = await background_pool.run(fetch_and_save_route_data)
         return {
             "status": "success",
             "message": "Route data refreshed",
             "data": result
         }
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
 
@@ -0,0 +1,78 @@
+"""Check-in files with blank cells load and aggregate like the rows that are complete.
+
+Run from backend/ with: python -m pytest -q test_incomplete_rows.py
+"""
+import os
+
+import pytest
+
+import main
+from benchmark import engine_results
+
+HEADER = "Date,Hour,Route,Total Count,By SmartCard,By QR,Number Of Busses,Operator\n"
+BASE_ROWS = (
+    "2024-01-01,6,2,50,40,10,2,B\n"
+    "2024-01-01,7,,100,90,10,2,A\n"     # no route: dropped, not added to the cell before it
+    "2024-01-01,7,1,30,30,,1,A\n"       # blank counter: counts as 0
+    "2024-01-01,,1,30,30,0,1,A\n"
+    ",8,1,30,30,0,1,A\n"
+    "2024-01-01,8,1,30,30,0,1,\n"
+)
+DROP_ROWS = (
+    "2024-01-02,8,1,20,20,,1,A\n"
+    "2024-01-02,9,,70,70,0,1,A\n"
+)
+
+
+@pytest.fixture(scope="module")
+def snapshot(tmp_path_factory):
+    workdir = tmp_path_factory.mktemp("incomplete")
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        with open(main.CHECKIN_CSV, "w") as f:
+            f.write(HEADER + BASE_ROWS)
+        os.makedirs(main.CHECKIN_DROP_DIR)
+        with open(os.path.join(main.CHECKIN_DROP_DIR, "latest.csv"), "w") as f:
+            f.write(HEADER + DROP_ROWS)
+        assert main.load_bus_data()
+        yield main.current_snapshot()
+    finally:
+        os.chdir(cwd)
+
+
+def test_only_complete_rows_are_kept(snapshot):
+    assert len(snapshot.data) == 3
+    for col in main.COUNT_COLUMNS:
+        assert snapshot.data[col].dtype.kind in "iu"
+
+
+def test_analytics_ignore_incomplete_rows(snapshot):
+    agg = main.aggregate_analytics(snapshot.cube)
+    by_route = agg['by_route'].set_index('Route')
+    assert by_route.loc['1', 'Total Count'] == 50
+    assert by_route.loc['2', 'Total Count'] == 50
+    assert by_route.loc['1', 'By QR'] == 0
+    by_company = agg['by_company'].set_index('Operator')
+    assert by_company.loc['A', 'By QR'] == 0
+    assert by_company.loc['B', 'Total Count'] == 50
+    by_hour = agg['by_hour'].set_index('Hour')
+    assert by_hour.loc[6, 'Total Count'] == 50
+
+
+def test_series_and_records_hold_real_counts(snapshot):
+    series = snapshot.daily.series("day")
+    assert series['Total Count'].tolist() == [80, 20]
+    assert series['By QR'].tolist() == [10, 0]
+    records = main.checkin_records(snapshot.data)
+    assert [record['By QR'] for record in records] == [10, 0, 0]
+
+
+def test_duckdb_engine_skips_the_same_rows(snapshot):
+    if main.duckdb is None:
+        pytest.skip("duckdb is not installed")
+    scenarios = {"all data": {}, "one route": {"routes": ["1"]}, "morning": {"hour_start": 6, "hour_end": 8}}
+    expected, _ = engine_results(main.PandasEngine(), snapshot, scenarios)
+    result, _ = engine_results(main.DuckDBEngine(), snapshot, scenarios)
+    for name in expected:
+        assert main.encode_json(result[name]) == main.encode_json(expected[name]), name
@@ -0,0 +1,63 @@
+"""Conformance of the DuckDB query engine against the in-memory pandas engine.
+
+Run from backend/ with: python -m pytest -q test_query_engines.py
+"""
+import os
+
+import pandas as pd
+import pytest
+
+pytest.importorskip("duckdb")
+
+import main
+from benchmark import engine_results, synthetic_checkins
+
+
+@pytest.fixture(scope="module")
+def snapshot(tmp_path_factory):
+    """A few thousand check-ins, with the last tenth appended from the drop directory."""
+    df = synthetic_checkins(5000, n_routes=40)
+    split = len(df) * 9 // 10
+    workdir = tmp_path_factory.mktemp("engines")
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        df.iloc[:split].to_csv(main.CHECKIN_CSV, index=False)
+        os.makedirs(main.CHECKIN_DROP_DIR)
+        df.iloc[split:].to_csv(os.path.join(main.CHECKIN_DROP_DIR, "latest.csv"), index=False)
+        assert main.load_bus_data()
+        # DuckDB reads the snapshot's files lazily, so the tests stay in the work dir.
+        yield main.current_snapshot()
+    finally:
+        os.chdir(cwd)
+
+
+def scenarios(snapshot):
+    routes = list(snapshot.cube.routes[::7])
+    last_day = snapshot.data['Date'].iloc[-1]
+    week = str((last_day - pd.Timedelta(days=2)).date())
+    return {
+        "all data": {},
+        "last days": {"start_date": week},
+        "peak hours": {"hour_start": 7, "hour_end": 9},
+        "two companies": {"companies": ["BakuBus", "Sahil"]},
+        "some routes": {"routes": routes},
+        "everything": {"start_date": "2022-01-02", "end_date": week, "hour_start": 6, "hour_end": 20,
+                       "companies": ["Qala", "AzTrans"], "routes": routes},
+        "empty window": {"start_date": str((last_day + pd.Timedelta(days=1)).date())},
+        "inverted hours": {"hour_start": 12, "hour_end": 8},
+    }
+
+
+def test_snapshot_includes_drop_file(snapshot):
+    assert len(snapshot.data) == 5000
+    assert snapshot.ingested
+
+
+def test_engines_agree(snapshot):
+    cases = scenarios(snapshot)
+    expected, _ = engine_results(main.PandasEngine(), snapshot, cases)
+    result, _ = engine_results(main.DuckDBEngine(), snapshot, cases)
+    assert expected.keys() == result.keys()
+    for name in expected:
+        assert main.encode_json(result[name]) == main.encode_json(expected[name]), name
@@ -7,12 +7,18 @@ import {
 import { ArrowUpDown, ArrowUp, ArrowDown, Download } from 'lucide-react';
 import './BusAnalytics.css';
 
+const API_URL = 'http://localhost:8000';
+const TABLE_PAGE_SIZE = 100;
+const SEARCH_DEBOUNCE_MS = 300;
+
 const BusAnalytics = () => {
   const [loading, setLoading] = useState(true);
   const [analytics, setAnalytics] = useState(null);
+  const [dropdowns, setDropdowns] = useState(null);
   const [tableData, setTableData] = useState([]);
-  const [filteredTableData, setFilteredTableData] = useState([]);
+  const [tableTotal, setTableTotal] = useState(0);
   const [searchTerm, setSearchTerm] = useState('');
+  const [debouncedSearch, setDebouncedSearch] = useState('');
   
   const [filters, setFilters] = useState({
     dateStart: '',
@@ -25,20 +31,40 @@ const BusAnalytics = () => {
 
   const [sortConfig, setSortConfig] = useState({ key: null, direction: 'asc' });
 
+  useEffect(() => {
+    loadDimensions();
+  }, []);
+
   useEffect(() => {
     loadAnalytics();
-    loadTableData();
   }, [filters]);
 
+  const loadDimensions = async () => {
+    try {
+      const response = await fetch(`${API_URL}/api/bus/dimensions`);
+      setDropdowns(await response.json());
+    } catch (error) {
+      console.error('Error loading filter options:', error);
+    }
+  };
+
+  useEffect(() => {
+    const timer = setTimeout(() => setDebouncedSearch(searchTerm), SEARCH_DEBOUNCE_MS);
+    return () => clearTimeout(timer);
+  }, [searchTerm]);
+
   useEffect(() => {
-    filterAndSortTable();
-  }, [tableData, searchTerm, sortConfig]);
+    // Abort the previous request so an older search can never overwrite a newer one.
+    const controller = new AbortController();
+    loadTableData(controller.signal);
+    return () => controller.abort();
+  }, [filters, debouncedSearch, sortConfig]);
 
   const loadAnalytics = async () => {
     try {
       setLoading(true);
       
-      const params = new URLSearchParams();
+      const params = new URLSearchParams({ dropdowns: 'false' });
       if (filters.dateStart) params.append('start_date', filters.dateStart);
       if (filters.dateEnd) params.append('end_date', filters.dateEnd);
       if (filters.hourStart) params.append('hour_start', filters.hourStart);
@@ -46,7 +72,7 @@ const BusAnalytics = () => {
       if (filters.company) params.append('companies', filters.company);
       if (filters.route) params.append('routes', filters.route);
       
-      const response = await fetch(`http://localhost:8000/api/bus/analytics?${params}`);
+      const response = await fetch(`${API_URL}/api/bus/analytics?${params}`);
       const data = await response.json();
       setAnalytics(data);
     } catch (error) {
@@ -56,59 +82,38 @@ const BusAnalytics = () => {
     }
   };
 
-  const loadTableData = async () => {
+  const tableParams = () => {
+    const params = new URLSearchParams();
+    if (filters.company) params.append('operator', filters.company);
+    if (filters.route) params.append('route', filters.route);
+    if (filters.dateStart) params.append('start_date', filters.dateStart);
+    if (filters.dateEnd) params.append('end_date', filters.dateEnd);
+    if (filters.hourStart) params.append('hour_start', filters.hourStart);
+    if (filters.hourEnd) params.append('hour_end', filters.hourEnd);
+    if (debouncedSearch) params.append('search', debouncedSearch);
+    return params;
+  };
+
+  const loadTableData = async (signal) => {
     try {
-      const params = new URLSearchParams();
-      if (filters.company) params.append('operator', filters.company);
-      if (filters.route) params.append('route', filters.route);
-      if (filters.dateStart) params.append('start_date', filters.dateStart);
-      if (filters.dateEnd) params.append('end_date', filters.dateEnd);
+      const params = tableParams();
+      params.append('limit', TABLE_PAGE_SIZE);
+      if (sortConfig.key) {
+        params.append('sort', sortConfig.key);
+        params.append('order', sortConfig.direction);
+      }
       
-      const response = await fetch(`http://localhost:8000/api/bus/registrations?limit=10000&${params}`);
+      const response = await fetch(`${API_URL}/api/bus/registrations?${params}`, { signal });
       const data = await response.json();
       setTableData(data.data || []);
+      setTableTotal(data.total || 0);
     } catch (error) {
-      console.error('Error loading table data:', error);
+      if (error.name !== 'AbortError') {
+        console.error('Error loading table data:', error);
+      }
     }
   };
 
-  const filterAndSortTable = () => {
-    let filtered = [...tableData];
-
-    if (filters.hourStart) {
-      filtered = filtered.filter(row => row.Hour >= parseInt(filters.hourStart));
-    }
-    if (filters.hourEnd) {
-      filtered = filtered.filter(row => row.Hour <= parseInt(filters.hourEnd));
-    }
-
-    if (searchTerm) {
-      const term = searchTerm.toLowerCase();
-      filtered = filtered.filter(row => 
-        row.Route?.toString().toLowerCase().includes(term) ||
-        row.Operator?.toLowerCase().includes(term)
-      );
-    }
-
-    if (sortConfig.key) {
-      filtered.sort((a, b) => {
-        let aVal = a[sortConfig.key];
-        let bVal = b[sortConfig.key];
-
-        if (sortConfig.key === 'pass_per_bus') {
-          aVal = a['Total Count'] / a['Number Of Busses'];
-          bVal = b['Total Count'] / b['Number Of Busses'];
-        }
-
-        if (aVal < bVal) return sortConfig.direction === 'asc' ? -1 : 1;
-        if (aVal > bVal) return sortConfig.direction === 'asc' ? 1 : -1;
-        return 0;
-      });
-    }
-
-    setFilteredTableData(filtered);
-  };
-
   const handleSort = (key) => {
     let direction = 'asc';
     if (sortConfig.key === key && sortConfig.direction === 'asc') {
@@ -142,30 +147,16 @@ const BusAnalytics = () => {
   };
 
   const exportData = () => {
-    const csv = [
-      ['Date', 'Hour', 'Route', 'Passengers', 'SmartCard', 'QR', 'Buses', 'Company', 'Pass/Bus'],
-      ...filteredTableData.map(row => [
-        row.Date?.split('T')[0],
-        row.Hour,
-        row.Route,
-        row['Total Count'],
-        row['By SmartCard'],
-        row['By QR'],
-        row['Number Of Busses'],
-        row.Operator,
-        (row['Total Count'] / row['Number Of Busses']).toFixed(1)
-      ])
-    ].map(row => row.join(',')).join('\n');
-
-    const blob = new Blob([csv], { type: 'text/csv' });
-    const url = window.URL.createObjectURL(blob);
+    const params = tableParams();
+    params.append('format', 'csv');
+
     const a = document.createElement('a');
-    a.href = url;
+    a.href = `${API_URL}/api/bus/export?${params}`;
     a.download = 'bus_analytics.csv';
     a.click();
   };
 
-  if (loading || !analytics) {
+  if (loading || !analytics || !dropdowns) {
     return (
       <div className="loading-container">
         <div className="spinner" />
@@ -174,7 +165,7 @@ const BusAnalytics = () => {
     );
   }
 
-  const { kpis, by_company, by_hour, top_routes, bottom_routes, dropdowns } = analytics;
+  const { kpis, by_company, by_hour, top_routes, bottom_routes } = analytics;
   const COLORS = ['#00f5ff', '#ff6b35', '#00ff9f', '#ffd93d', '#ff495c', '#a855f7'];
 
   // Calculate top companies by pass/bus
@@ -413,7 +404,7 @@ const BusAnalytics = () => {
             className="search-input"
           />
           <div className="table-info">
-            Showing {filteredTableData.length.toLocaleString()} records
+            Showing {tableData.length.toLocaleString()} of {tableTotal.toLocaleString()} records
           </div>
         </div>
 
@@ -451,7 +442,7 @@ const BusAnalytics = () => {
               </tr>
             </thead>
             <tbody>
-              {filteredTableData.slice(0, 100).map((row, idx) => {
+              {tableData.map((row, idx) => {
                 const passPerBus = row['Total Count'] / row['Number Of Busses'];
                 return (
                   <tr key={idx}>
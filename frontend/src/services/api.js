@@ -30,6 +30,12 @@ export const busAPI = {
   
   getHourlyTrend: (params = {}) => 
     api.get('/api/bus/hourly-trend', { params }),
+  
+  getTimeseries: (params = {}) => 
+    api.get('/api/bus/timeseries', { params }),
+  
+  getDimensions: () => 
+    api.get('/api/bus/dimensions'),
 };
 
 // Demographics APIs